@@ -1,98 +1,688 @@
-from elasticsearch import Elasticsearch
+import base64
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from itertools import islice
+
+from elasticsearch import Elasticsearch, Transport, TransportError, ConnectionError, ConnectionTimeout, helpers
 import logging
 
+from apps.backend.utils.settings import get_config
+
 logging.basicConfig(filename='expertsearch.log', format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
+
+class BackoffTransport(Transport):
+    """
+    Transport that retries failed requests with exponential backoff once the connection pool retries are exhausted,
+    so that a restarting or overloaded cluster is not hammered with immediate retries.
+    """
+
+    def __init__(self, hosts, backoff_retries=3, initial_backoff=0.5, max_backoff=8, **kwargs):
+        super().__init__(hosts, **kwargs)
+        self.backoff_retries = backoff_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        for attempt in range(self.backoff_retries + 1):
+            try:
+                return super().perform_request(method, url, headers=headers, params=params, body=body)
+
+            except TransportError as e:
+                if isinstance(e, ConnectionTimeout):
+                    retry = self.retry_on_timeout
+                elif isinstance(e, ConnectionError):
+                    retry = True
+                else:
+                    retry = e.status_code in self.retry_on_status
+
+                if not retry or attempt == self.backoff_retries:
+                    raise
+
+                time.sleep(min(self.initial_backoff * 2 ** attempt, self.max_backoff))
+
+
+# Elasticsearch client shared by all ElasticSearchAPI instances of the process
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get the process wide Elasticsearch client, creating it on first use.
+    The client keeps a pool of persistent (keep-alive) HTTP connections per node, sized by "maxsize".
+    Hosts, pool size, timeouts, retries, backoff and sniffing are read from the "elasticsearch" section of
+    config/config.json. A new client is created in a forked worker (gunicorn) instead of sharing the sockets
+    of the parent process.
+    :return: Elasticsearch client
+    """
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                options = dict(get_config("elasticsearch"))
+                hosts = options.pop("hosts", [{'host': 'localhost', 'port': 9200}])
+                options.setdefault("retry_on_status", [429, 502, 503, 504])
+                _client = Elasticsearch(hosts, transport_class=BackoffTransport, **options)
+                _client_pid = os.getpid()
+
+    return _client
+
+
+# index version behind the alias and facet counts, shared by all ElasticSearchAPI instances of the process
+_index_version = {"version": None, "checked_at": 0.0, "failed_at": None}
+_facets_cache = {"version": None, "facets": None}
+_cache_lock = threading.Lock()
+
+
 class ElasticSearchAPI:
     def __init__(self):
-        self.es = Elasticsearch([{'host': 'localhost', 'port': 9200}])
+        # alias served to the searches. Points to the latest versioned index, e.g. faculty_index_v<timestamp>
         self.index = "faculty_index"
         self.doc_type = 'faculty'
 
-    def add_records(self, corpus: list):
+        # bulk indexing defaults
+        self.chunk_size = 500
+        self.thread_count = 4
+        self.max_retries = 3
+        self.refresh_interval = "1s"
+
+        # number of versioned indices kept for rollback, including the live one
+        self.keep_versions = 2
+
+        # max number of searches sent in one _msearch request
+        self.msearch_group_size = 50
+
+        # how long a point in time is kept open between two pages
+        self.pit_keep_alive = "2m"
+
+        # facet name -> field aggregated for the facet counts
+        self.facet_fields = {"university": "faculty_university_name",
+                             "department": "faculty_department_name",
+                             "location": "faculty_location"}
+        self.facet_size = 1000
+
+        # seconds between two lookups of the index version behind the alias
+        self.version_check_interval = 5
+
+        # seconds the cluster is not called again after a connection error. Searches meanwhile return empty
+        # results at once instead of waiting for the transport retries.
+        self.unavailable_retry_interval = 30
+
+        # fields returned to the search page. faculty_biodata is searched but never fetched.
+        self.display_fields = ["faculty_name", "faculty_homepage_url", "faculty_department_url",
+                               "faculty_department_name", "faculty_university_url", "faculty_university_name",
+                               "faculty_email", "faculty_phone", "faculty_location", "faculty_expertise"]
+
+        # filter fields are indexed as text for the search and as keyword sub-fields for the filters
+        keyword_text = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+        self.mappings = {
+            "properties": {
+                "faculty_university_name": keyword_text,
+                "faculty_department_name": keyword_text,
+                "faculty_location": keyword_text
+            }
+        }
+
+    @property
+    def es(self):
+        """
+        Elasticsearch client of the current process. Resolved on every use, so an instance created before a
+        fork (gunicorn workers) uses the client of the worker instead of the sockets of the parent process.
+        """
+        return get_client()
+
+    def __chunks(self, corpus, chunk_size):
+        """
+        Lazily splits an iterable of records in to lists of at most chunk_size records.
+        Private method. Not accessible outside the class.
+        :param corpus: any iterable of faculty records (list, generator, cursor iterator)
+        :param chunk_size: max number of records per chunk
+        :return: generator of lists
+        """
+        iterator = iter(corpus)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __bulk_actions(self, corpus, index):
+        """
+        Lazily converts faculty records to _bulk index actions.
+        Private method. Not accessible outside the class.
+        """
+        for record in corpus:
+            yield {"_op_type": "index", "_index": index, "_id": record["id"], "_source": record}
 
+    def __send_chunk(self, chunk_no, chunk):
+        """
+        Sends one chunk of actions through the _bulk API. Rejected (429) requests are retried with backoff.
+        Deleting a document that is not in the index is not reported as an error.
+        Private method. Not accessible outside the class.
+        :return: dictionary with the chunk report: chunk number, indexed count and per document errors
+        """
+        report = {"chunk": chunk_no, "records": len(chunk), "indexed": 0, "errors": []}
         try:
-            print("Deleting old index...")
-            #iterate through documents indexing them
-            self.es.indices.delete(index=self.index)
-            print("Old Index deleted: ", len(corpus))
+            indexed, errors = helpers.bulk(self.es, chunk, chunk_size=len(chunk), max_retries=self.max_retries,
+                                           raise_on_error=False, raise_on_exception=False)
+            missing = [error for error in errors if error.get("delete", {}).get("status") == 404]
+            report["indexed"] = indexed + len(missing)
+            report["errors"] = [error for error in errors if error not in missing]
 
         except Exception as e:
-            print("Unexpected Exception occured in delete index: ", repr(e))
-            pass
+            report["errors"] = [repr(e)]
+
+        return report
+
+    def __bulk(self, actions, chunk_size=None, thread_count=None):
+        """
+        Streams _bulk actions to the cluster in chunks sent by a pool of worker threads.
+        At most 2 chunks per worker are held in memory, so the actions can be generated
+        from a cursor over the whole faculty table.
+        Private method. Not accessible outside the class.
+        :return: dictionary with the indexed and failed counts along with the reports of the failed chunks
+        """
+        chunk_size = chunk_size if chunk_size else self.chunk_size
+        thread_count = thread_count if thread_count else self.thread_count
+
+        summary = {"indexed": 0, "failed": 0, "failed_chunks": []}
+
+        def collect(future):
+            report = future.result()
+            summary["indexed"] += report["indexed"]
+            summary["failed"] += report["records"] - report["indexed"]
+            if report["errors"]:
+                summary["failed_chunks"].append(report)
+                print(f"Chunk {report['chunk']}: {len(report['errors'])} error(s) while indexing "
+                      f"{report['records']} record(s). First error: {report['errors'][0]}")
 
-        print("Corpus: ", len(corpus))
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            pending = set()
+            for chunk_no, chunk in enumerate(self.__chunks(actions, chunk_size), start=1):
+                pending.add(executor.submit(self.__send_chunk, chunk_no, chunk))
+
+                # bound the number of in flight chunks to keep memory constant
+                if len(pending) >= 2 * thread_count:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+
+            for future in pending:
+                collect(future)
+
+        return summary
+
+    def bulk_index(self, corpus, index=None, chunk_size=None, thread_count=None):
+        """
+        Streams faculty records in to the index through the _bulk API.
+        :param corpus: iterable of faculty record dictionaries. Each record must have an "id" key.
+        :param index: index name. Defaults to faculty index.
+        :param chunk_size: number of records per _bulk request
+        :param thread_count: number of parallel workers sending chunks
+        :return: dictionary with the indexed and failed counts along with the reports of the failed chunks
+        """
+        index = index if index else self.index
+        return self.__bulk(self.__bulk_actions(corpus, index), chunk_size, thread_count)
+
+    def sync_records(self, corpus, deleted_ids=None, chunk_size=None, thread_count=None):
+        """
+        Applies changed faculty records to the live index in place: upserts the records and deletes the ids.
+        :param corpus: iterable of changed faculty record dictionaries. Each record must have an "id" key.
+        :param deleted_ids: iterable of deleted faculty ids
+        :param chunk_size: number of actions per _bulk request
+        :param thread_count: number of parallel workers sending chunks
+        :return: dictionary with the applied and failed counts along with the reports of the failed chunks
+        """
+        def actions():
+            yield from self.__bulk_actions(corpus, self.index)
+            for id in deleted_ids or []:
+                yield {"_op_type": "delete", "_index": self.index, "_id": id}
+
+        summary = self.__bulk(actions(), chunk_size, thread_count)
+
+        # changes the index version, so that caches keyed on it (facets, search results) are invalidated
+        if summary["indexed"]:
+            self.es.indices.put_mapping(index=self.index, body={"_meta": {"synced_at": datetime.now().isoformat()}})
+        print(f"Index sync complete: {summary['indexed']} change(s) applied, {summary['failed']} change(s) failed")
+
+        return summary
+
+    def __new_index_name(self):
+        """
+        Versioned index name for a rebuild, e.g. faculty_index_v20211205120000123456
+        Private method. Not accessible outside the class.
+        """
+        return f"{self.index}_v{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+
+    def get_current_index(self):
+        """
+        Get the versioned index the faculty_index alias points to.
+        :return: index name or None if the alias does not exist yet
+        """
+        if not self.es.indices.exists_alias(name=self.index):
+            return None
+
+        indices = sorted(self.es.indices.get_alias(name=self.index).keys())
+        return indices[-1] if indices else None
+
+    def get_index_version(self, refresh=False):
+        """
+        Get the version of the searched data: the versioned index behind the alias and the time of the last
+        incremental sync in to it, e.g. faculty_index_v20211205120000123456@2021-12-06T10:00:00.
+        The lookup is cached for version_check_interval seconds, so callers can use the version as a cache key
+        on every request.
+        :param refresh: skip the cached value
+        :return: version string or None if the index does not exist yet or the cluster is unreachable
+        """
+        if not refresh and self.__unavailable():
+            return None
+
+        with _cache_lock:
+            if not refresh and time.time() - _index_version["checked_at"] < self.version_check_interval:
+                return _index_version["version"]
+
+        version = None
         try:
-            print(f"Rebuilding new index with {len(corpus)} records in corpus")
-            for record in corpus:
-                # print (record)
-                self.es.index(index=self.index, doc_type=self.doc_type, id=record["id"], document=record)
+            mappings = self.es.indices.get_mapping(index=self.index, ignore=404)
+        except TransportError as e:
+            # the version is not cached, the cluster is called again once it is back
+            print("Unexpected Elasticsearch error: While getting the index version: ", repr(e))
+            self.__set_unavailable(e)
+            return None
 
-            result = self.es.search(index=self.index, body={"query": {"match_all": {}}})
-            print(f"New Index Created with record count {len(result['hits']['hits'])}")
+        for name, mapping in sorted(mappings.items()):
+            if name not in ("error", "status"):
+                version = f"{name}@{mapping['mappings'].get('_meta', {}).get('synced_at', '')}"
 
-        except Exception as e:
-            print ("Unexpected Exception occured in create index: ", repr(e))
+        with _cache_lock:
+            _index_version["version"] = version
+            _index_version["checked_at"] = time.time()
+            _index_version["failed_at"] = None
+
+        return version
 
-        print(f"Indexing complete: with {len(corpus)} records")
+    def __unavailable(self):
+        """
+        Whether the cluster failed to connect less than unavailable_retry_interval seconds ago.
+        Private method. Not accessible outside the class.
+        """
+        with _cache_lock:
+            failed_at = _index_version["failed_at"]
+        return failed_at is not None and time.time() - failed_at < self.unavailable_retry_interval
 
-        return
+    def __set_unavailable(self, e):
+        """
+        Records a connection error, so that the searches of the next unavailable_retry_interval seconds fail fast.
+        Private method. Not accessible outside the class.
+        """
+        if isinstance(e, ConnectionError):
+            with _cache_lock:
+                _index_version["failed_at"] = time.time()
 
-    def get_search_results(self, query, n=10, university_filter=None, department_filter=None, location_filter=None):
-        university_filter = university_filter if university_filter else ""
-        department_filter = department_filter if department_filter else ""
-        location_filter = location_filter if location_filter else ""
+    def get_index_versions(self):
+        """
+        Get all versioned faculty indices, oldest first.
+        :return: list of index names
+        """
+        return sorted(self.es.indices.get(index=f"{self.index}_v*", ignore_unavailable=True).keys())
 
-        query = {
+    def __warm_index(self, index):
+        """
+        Merges the freshly loaded index down to a single segment and runs a query over the searched fields,
+        so the first searches after the alias swap do not pay for cold segments and caches.
+        Private method. Not accessible outside the class.
+        """
+        self.es.indices.forcemerge(index=index, max_num_segments=1)
+        self.es.search(index=index, size=0, query={
             "multi_match": {
-              "query":  f"{query} {university_filter} {department_filter} {location_filter}".strip(),
-              "fields": ["faculty_biodata", "faculty_name", "faculty_university_name", "faculty_department_name", "faculty_location"]
+                "query": "research",
+                "fields": ["faculty_biodata", "faculty_name", "faculty_university_name", "faculty_department_name",
+                           "faculty_location"]
             }
-        }
+        })
+
+    def __swap_alias(self, index):
         """
-        else:
-            query = {
-                "multi_match": {
-                  "query":  query,
-                  "fields": ["faculty_biodata", "faculty_name"]
-                },
-                "filter": {
-                    "term": {
-                        "faculty_university_name": university_filter,
-                        ""
+        Atomically moves the faculty_index alias on to the index. A concrete index left by older releases under
+        the alias name is removed in the same request.
+        Private method. Not accessible outside the class.
+        """
+        actions = [{"add": {"index": index, "alias": self.index}}]
+
+        if self.es.indices.exists_alias(name=self.index):
+            for old_index in self.es.indices.get_alias(name=self.index).keys():
+                actions.insert(0, {"remove": {"index": old_index, "alias": self.index}})
+
+        elif self.es.indices.exists(index=self.index):
+            actions.insert(0, {"remove_index": {"index": self.index}})
+
+        self.es.indices.update_aliases(body={"actions": actions})
+
+    def __delete_old_versions(self, keep_versions):
+        """
+        Deletes all but the latest keep_versions versioned indices. The index behind the alias is never deleted.
+        Private method. Not accessible outside the class.
+        """
+        current_index = self.get_current_index()
+        versions = [index for index in self.get_index_versions() if index != current_index]
+        for index in versions[:max(len(versions) - (keep_versions - 1), 0)]:
+            print(f"Deleting old index version {index}")
+            self.es.indices.delete(index=index, ignore_unavailable=True)
+
+    def add_records(self, corpus, chunk_size=None, thread_count=None, keep_versions=None):
+        """
+        Rebuilds the faculty index from the corpus without search downtime.
+        Records are loaded in to a new versioned index while the faculty_index alias keeps serving the old one.
+        Refresh is disabled during the load. The new index is then refreshed and warmed, the alias is moved
+        on to it atomically and older versions are deleted.
+        :param corpus: iterable of faculty record dictionaries. Each record must have an "id" key.
+        :param chunk_size: number of records per _bulk request
+        :param thread_count: number of parallel workers sending chunks
+        :param keep_versions: number of index versions to keep, including the live one
+        :return: dictionary with the indexed and failed counts along with the reports of the failed chunks.
+                 Has an "error" key if the new index could not be built and the alias was not moved.
+        """
+        keep_versions = keep_versions if keep_versions else self.keep_versions
+        index = self.__new_index_name()
+
+        summary = {"indexed": 0, "failed": 0, "failed_chunks": []}
+        try:
+            print(f"Rebuilding new index {index}...")
+            self.es.indices.create(index=index, body={"settings": {"index": {"refresh_interval": "-1"}},
+                                                     "mappings": self.mappings})
+
+            summary = self.bulk_index(corpus, index=index, chunk_size=chunk_size, thread_count=thread_count)
+
+            self.es.indices.put_settings(index=index, body={"index": {"refresh_interval": self.refresh_interval}})
+            self.es.indices.refresh(index=index)
+
+            result = self.es.count(index=index)
+            print(f"New Index Created with record count {result['count']}")
+
+            if not result['count'] and summary["failed"]:
+                raise Exception(f"No records indexed in {index}. Keeping the current index.")
+
+            self.__warm_index(index)
+            self.__swap_alias(index)
+            print(f"Alias {self.index} moved to {index}")
+
+        except Exception as e:
+            print ("Unexpected Exception occured in create index: ", repr(e))
+            summary["error"] = repr(e)
+
+            # the cluster may be what failed: the partial index is then left for __delete_old_versions
+            try:
+                self.es.indices.delete(index=index, ignore_unavailable=True)
+
+            except Exception as cleanup_error:
+                print("Unexpected Exception occured in delete index: ", repr(cleanup_error))
+
+            return summary
+
+        try:
+            self.__delete_old_versions(keep_versions)
+
+        except Exception as e:
+            print("Unexpected Exception occured in delete index: ", repr(e))
+
+        print(f"Indexing complete: {summary['indexed']} record(s) indexed, {summary['failed']} record(s) failed")
+
+        return summary
+
+    def __filter_clauses(self, university_filter=None, department_filter=None, location_filter=None):
+        """
+        Builds the bool filter clauses for the selected filters. Filters are exact terms clauses on the keyword
+        sub-fields, so they do not affect the score and their bitsets are cached by the cluster across searches.
+        Private method. Not accessible outside the class.
+        :param university_filter: university name or list of university names (multi-select)
+        :param department_filter: department name or list of department names (multi-select)
+        :param location_filter: location or list of locations (multi-select)
+        :return: list of filter clauses
+        """
+        clauses = []
+        for field, values in (("faculty_university_name", university_filter),
+                              ("faculty_department_name", department_filter),
+                              ("faculty_location", location_filter)):
+            values = [values] if isinstance(values, str) else values
+            values = [value.strip() for value in values or [] if value and value.strip()]
+            if values:
+                clauses.append({"terms": {f"{field}.keyword": values}})
+
+        return clauses
+
+    def __search_query(self, query, university_filter=None, department_filter=None, location_filter=None):
+        """
+        Builds the query: free text match on the searched fields, restricted by the filter clauses.
+        Private method. Not accessible outside the class.
+        """
+        return {
+            "bool": {
+                "must": {
+                    "multi_match": {
+                      "query":  query,
+                      "fields": ["faculty_biodata", "faculty_name", "faculty_university_name",
+                                 "faculty_department_name", "faculty_location"]
                     }
-                }
+                },
+                "filter": self.__filter_clauses(university_filter, department_filter, location_filter)
             }
+        }
+
+    def __facet_aggregations(self):
+        """
+        Terms aggregations for the facet counts.
+        Private method. Not accessible outside the class.
+        """
+        return {name: {"terms": {"field": f"{field}.keyword", "size": self.facet_size}}
+                for name, field in self.facet_fields.items()}
+
+    def __parse_facets(self, res):
+        """
+        Private method. Not accessible outside the class.
+        :return: dictionary of facet name -> list of {"value": <>, "count": <>} ordered by descending count
+        """
+        aggregations = res.get("aggregations", {})
+        return {name: [{"value": bucket["key"], "count": bucket["doc_count"]}
+                       for bucket in aggregations.get(name, {}).get("buckets", [])]
+                for name in self.facet_fields}
+
+    def get_facets(self):
+        """
+        Get the facet values and counts of the whole index: universities, departments and locations.
+        Facets are computed once per index version and served from memory until the alias moves
+        or changes are synced in to the index.
+        :return: dictionary of facet name -> list of {"value": <>, "count": <>} ordered by descending count
         """
-        ranked_list =  []
+        empty = {name: [] for name in self.facet_fields}
         try:
-            # result = self.es.search(index=self.index, body={"query": {"match_all": {}}})
-            # print("total hits:", len(result["hits"]["hits"]))
-            # pprint(result)
-            res = self.es.search(index=self.index, query=query)
-            # print(res)
-
-            # print(f"Matched Query: {res['hits']['total']['value']}")
-            for record in res['hits']['hits'][:n]:
-                faculty = {}
-                faculty["faculty_name"] = record['_source']["faculty_name"]
-                faculty["faculty_homepage_url"] = record['_source']["faculty_homepage_url"]
-                faculty["faculty_department_url"] = record['_source']["faculty_department_url"]
-                faculty["faculty_department_name"] = record['_source']["faculty_department_name"]
-                faculty["faculty_university_url"] = record['_source']["faculty_university_url"]
-                faculty["faculty_university_name"] = record['_source']["faculty_university_name"]
-                faculty["faculty_email"] = record['_source']["faculty_email"]
-                faculty["faculty_phone"] = record['_source']["faculty_phone"]
-                faculty["faculty_location"] = record['_source']["faculty_location"]
-                faculty["faculty_expertise"] = record['_source']["faculty_expertise"]
-                ranked_list.append(faculty)
-
-            # pprint(ranked_list)
+            version = self.get_index_version()
+            with _cache_lock:
+                if version and _facets_cache["version"] == version:
+                    return _facets_cache["facets"]
+
+            if not version:
+                return empty
+
+            res = self.es.search(index=self.index, size=0, aggs=self.__facet_aggregations(), track_total_hits=False)
+            facets = self.__parse_facets(res)
+
+            with _cache_lock:
+                _facets_cache["version"] = version
+                _facets_cache["facets"] = facets
+
+        except Exception as e :
+            print ("Unexpected exception error: While getting facets: ", repr(e))
+            self.__set_unavailable(e)
+            return empty
+
+        return facets
+
+    def get_search_results(self, query, n=10, university_filter=None, department_filter=None, location_filter=None,
+                           offset=0):
+        """
+        Get the faculty ranked for the query.
+        Only the display fields of the top n hits starting at offset are fetched from the cluster.
+        :param query: search query string
+        :param n: number of results to return
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param offset: number of ranked results to skip
+        :return: list of faculty dictionaries with the display fields
+        """
+        return self.get_search_page(query, n, university_filter, department_filter, location_filter,
+                                    paginate=False, offset=offset)["results"]
+
+    def get_batch_search_results(self, searches: list, group_size=None):
+        """
+        Runs many searches through the _msearch API, group_size searches per round trip.
+        :param searches: list of dictionaries in below format. Only "query" is required.
+                         [{"query": <>,
+                           "num_results": <>,
+                           "university_filter": <>,
+                           "department_filter": <>,
+                           "location_filter": <>,
+                           "offset": <>
+                          }, {...}
+                         ]
+        :param group_size: max number of searches per _msearch request
+        :return: list of result lists, in the order of the searches. A failed search gets an empty list.
+        """
+        group_size = group_size if group_size else self.msearch_group_size
+        if self.__unavailable():
+            print("Elasticsearch unavailable: skipping batch search")
+            return [[] for _ in searches]
+
+        batch_results = []
+        for start in range(0, len(searches), group_size):
+            group = searches[start:start + group_size]
+
+            body = []
+            for search in group:
+                body.append({"index": self.index})
+                body.append({
+                    "query": self.__search_query(search["query"], search.get("university_filter"),
+                                                 search.get("department_filter"), search.get("location_filter")),
+                    "size": search.get("num_results", 10),
+                    "from": search.get("offset", 0),
+                    "_source": self.display_fields,
+                    "track_total_hits": False
+                })
+
+            try:
+                responses = self.es.msearch(body=body, index=self.index)["responses"]
+
+            except Exception as e :
+                print ("Unexpected exception error: While getting batch search results: ", repr(e))
+                self.__set_unavailable(e)
+                responses = [{"error": repr(e)}] * len(group)
+
+            for i, res in enumerate(responses):
+                if "error" in res:
+                    print(f"Search {start + i} failed in batch: {res['error']}")
+                    batch_results.append([])
+                    continue
+
+                batch_results.append([{field: record['_source'].get(field) for field in self.display_fields}
+                                      for record in res['hits']['hits']])
+
+        return batch_results
+
+    def __encode_cursor(self, pit_id, search_after):
+        """
+        Opaque page cursor: the point in time id and the sort values of the last hit.
+        Private method. Not accessible outside the class.
+        """
+        cursor = json.dumps({"pit": pit_id, "search_after": search_after}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+    def __decode_cursor(self, cursor):
+        """
+        Private method. Not accessible outside the class.
+        :return: tuple of point in time id and search_after sort values
+        """
+        cursor = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return cursor["pit"], cursor["search_after"]
+
+    def get_search_page(self, query, n=10, university_filter=None, department_filter=None, location_filter=None,
+                        cursor=None, paginate=True, offset=0, with_facets=False):
+        """
+        Get one page of the faculty ranked for the query.
+        With paginate (or a cursor) the first page opens a point in time on the index, so that the following pages
+        are read from the same index version even if a reindex moves the alias meanwhile. Pages are fetched with
+        search_after, so a deep page costs the same as the first one.
+        Without paginate the page is read with size and offset and no cursor is returned.
+        :param query: search query string
+        :param n: page size
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param cursor: cursor returned with the previous page. None for the first page.
+        :param paginate: return a cursor for the next page
+        :param offset: number of ranked results to skip when not paginating
+        :param with_facets: also return the university, department and location counts of the matching faculty
+        :return: dictionary with the "results" list of faculty dictionaries, the "cursor" of the next page
+                 (None on the last page) and the "facets" if requested
+        """
+        page = {"results": [], "cursor": None}
+        if with_facets:
+            page["facets"] = {name: [] for name in self.facet_fields}
+
+        if self.__unavailable():
+            print("Elasticsearch unavailable: skipping search")
+            return page
+
+        pit_id = None
+        try:
+            body = {
+                "query": self.__search_query(query, university_filter, department_filter, location_filter),
+                "size": n,
+                "_source": self.display_fields,
+                "track_total_hits": False
+            }
+            if with_facets:
+                body["aggs"] = self.__facet_aggregations()
+
+            if cursor:
+                pit_id, search_after = self.__decode_cursor(cursor)
+                body["search_after"] = search_after
+            elif paginate:
+                pit_id = self.es.open_point_in_time(index=self.index, keep_alive=self.pit_keep_alive)["id"]
+            else:
+                body["from"] = offset
+
+            if pit_id:
+                body["pit"] = {"id": pit_id, "keep_alive": self.pit_keep_alive}
+                body["sort"] = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+                res = self.es.search(body=body)
+                pit_id = res.get("pit_id", pit_id)
+            else:
+                res = self.es.search(index=self.index, body=body)
+
+            hits = res['hits']['hits']
+            for record in hits:
+                page["results"].append({field: record['_source'].get(field) for field in self.display_fields})
+
+            if with_facets:
+                page["facets"] = self.__parse_facets(res)
+
+            if pit_id and len(hits) == n:
+                page["cursor"] = self.__encode_cursor(pit_id, hits[-1]["sort"])
+            elif pit_id:
+                self.es.close_point_in_time(body={"id": pit_id}, ignore=404)
 
         except Exception as e :
-            print ("Unexpected exception error: While getting search results: ", repr(e))
+            print ("Unexpected exception error: While getting search page: ", repr(e))
+            self.__set_unavailable(e)
 
-        return ranked_list
+        return page
 
 
 if __name__ == '__main__':
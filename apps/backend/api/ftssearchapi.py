@@ -0,0 +1,94 @@
+import base64
+import json
+
+from apps.backend.utils.facultydb import FacultyDB
+from apps.backend.utils.settings import get_config
+
+
+class FTSSearchAPI:
+    """
+    Embedded search backend over the SQLite3 FTS5 index of FacultyDB, ranked by bm25() with column weights.
+    Has the same interface as ElasticSearchAPI for the search routes, for deployments without an Elasticsearch cluster.
+    """
+
+    def __init__(self):
+        self.faculty_db = FacultyDB()
+
+        # bm25 column weights for name, biodata, expertise, department, university and location
+        self.weights = get_config("search").get("fts_weights", [10.0, 1.0, 5.0, 2.0, 2.0, 2.0])
+
+        self.display_fields = ["faculty_name", "faculty_homepage_url", "faculty_department_url",
+                               "faculty_department_name", "faculty_university_url", "faculty_university_name",
+                               "faculty_email", "faculty_phone", "faculty_location", "faculty_expertise"]
+
+    def get_index_version(self, refresh=False):
+        """
+        Get the version of the searched data. Grows with every change of the faculty table.
+        :param refresh: not used. The version is read on every call.
+        :return: version string
+        """
+        return f"sqlite@{self.faculty_db.get_data_version()}"
+
+    def get_facets(self):
+        """
+        Get the facet values and counts of all faculty: universities, departments and locations.
+        :return: dictionary of facet name -> list of {"value": <>, "count": <>} ordered by descending count
+        """
+        try:
+            return self.faculty_db.get_facet_values()
+
+        except Exception as e :
+            print ("Unexpected exception error: While getting facets: ", repr(e))
+            return {"university": [], "department": [], "location": []}
+
+    def get_search_results(self, query, n=10, university_filter=None, department_filter=None, location_filter=None,
+                           offset=0):
+        """
+        Get the faculty ranked for the query.
+        :return: list of faculty dictionaries with the display fields
+        """
+        return self.get_search_page(query, n, university_filter, department_filter, location_filter,
+                                    paginate=False, offset=offset)["results"]
+
+    def get_search_page(self, query, n=10, university_filter=None, department_filter=None, location_filter=None,
+                        cursor=None, paginate=True, offset=0, with_facets=False):
+        """
+        Get one page of the faculty ranked for the query. The cursor holds the offset of the next page.
+        :return: dictionary with the "results" list of faculty dictionaries, the "cursor" of the next page
+                 (None on the last page) and the "facets" if requested
+        """
+        page = {"results": [], "cursor": None}
+        if with_facets:
+            page["facets"] = {"university": [], "department": [], "location": []}
+
+        try:
+            if cursor:
+                offset = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))["offset"]
+
+            records = self.faculty_db.search_fts(query, n, offset, university_filter, department_filter,
+                                                 location_filter, self.weights)
+            page["results"] = [{field: record[field] for field in self.display_fields} for record in records]
+
+            if with_facets:
+                page["facets"] = self.faculty_db.get_fts_facets(query, university_filter, department_filter,
+                                                                location_filter)
+
+            if (paginate or cursor) and len(records) == n:
+                next_cursor = json.dumps({"offset": offset + n}).encode("utf-8")
+                page["cursor"] = base64.urlsafe_b64encode(next_cursor).decode("ascii")
+
+        except Exception as e :
+            print ("Unexpected exception error: While getting search page: ", repr(e))
+
+        return page
+
+    def get_batch_search_results(self, searches: list, group_size=None):
+        """
+        Runs many searches, in the ElasticSearchAPI.get_batch_search_results format.
+        :param group_size: not used. Searches run locally.
+        :return: list of result lists, in the order of the searches
+        """
+        return [self.get_search_results(search["query"], search.get("num_results", 10),
+                                        search.get("university_filter"), search.get("department_filter"),
+                                        search.get("location_filter"), search.get("offset", 0))
+                for search in searches]
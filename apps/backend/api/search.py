@@ -1,21 +1,36 @@
 from apps.backend.utils.facultydb import FacultyDB
-from apps.backend.utils.ranker import Ranker
+from apps.backend.utils.ranker import Ranker, get_ranker
 class Search:
     def __init__(self):
-        pass
+        # faculty columns returned with the results, the biodata is left out so that it is not decompressed
+        self.display_fields = ["id", "faculty_name", "faculty_homepage_url", "faculty_department_url",
+                               "faculty_department_name", "faculty_university_url", "faculty_university_name",
+                               "faculty_email", "faculty_phone", "faculty_location", "faculty_expertise"]
 
 
     def get_search_results(self, query, num_of_results, university_filter, dept_filter, location_filter):
         try:
-            # print("Corpus Method")
-            corpus = FacultyDB().get_biodata_records(university_filter, dept_filter, location_filter)
-            #print(corpus)
+            # faculty matching the filters
+            doc_ids = None
+            if university_filter or dept_filter or location_filter:
+                doc_ids = FacultyDB().get_faculty_ids(university_filter, dept_filter, location_filter)
 
-            ranked_id_list = Ranker(corpus).score(query, num_of_results)
+            ranker = get_ranker()
+            if ranker is not None:
+                # rank with the prebuilt index, restricted to the faculty matching the filters
+                ranked_id_list = ranker.score(query, num_of_results, doc_ids)
+
+            else:
+                # no prebuilt index: index the faculty matching the filters the same way, in memory
+                ranked_id_list = Ranker.from_faculty_db(doc_ids).score(query, num_of_results)
             #print(ranked_id_list)
+            if not ranked_id_list:
+                return []
 
-            search_results_list  = FacultyDB().get_faculty_records(ranked_id_list)
-            print(search_results_list )
+            # records in the order of the ranking
+            records = FacultyDB().get_faculty_records(ranked_id_list, self.display_fields)
+            records_by_id = {record["id"]: record for record in records}
+            search_results_list = [records_by_id[int(id)] for id in ranked_id_list if int(id) in records_by_id]
 
             return search_results_list
 
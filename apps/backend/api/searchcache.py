@@ -0,0 +1,144 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from apps.backend.utils.settings import get_config
+
+
+class SearchCache:
+    """
+    Two tier cache of search responses: an in-process LRU with TTL and an optional Redis tier shared by all workers.
+    Keys embed the index version, so entries of an older index version are never served and simply age out.
+    """
+
+    def __init__(self):
+        cache_config = get_config("search_cache")
+        redis_config = cache_config.get("redis", {})
+
+        self.max_entries = cache_config.get("max_entries", 1024)
+        self.ttl = cache_config.get("ttl", 300)
+
+        self.redis_ttl = redis_config.get("ttl", 3600)
+        self.redis_prefix = redis_config.get("prefix", "expertsearch:search:")
+        self.redis = None
+        if redis_config.get("enabled", False):
+            self.redis = redis.Redis(host=redis_config.get("host", "localhost"), port=redis_config.get("port", 6379),
+                                     db=redis_config.get("db", 1), socket_timeout=redis_config.get("timeout", 0.1))
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__version = None
+        self.__stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0}
+
+    def key(self, version, query, num_results, university_filter=None, department_filter=None, location_filter=None,
+            offset=0):
+        """
+        Cache key of a search: index version, normalized query, filters and page.
+        :return: key string
+        """
+        def normalize_filter(values):
+            values = [values] if isinstance(values, str) else values
+            return sorted({value.strip() for value in values or [] if value and value.strip()})
+
+        search = {
+            "query": " ".join(str(query).lower().split()),
+            "num_results": num_results,
+            "offset": offset,
+            "university": normalize_filter(university_filter),
+            "department": normalize_filter(department_filter),
+            "location": normalize_filter(location_filter)
+        }
+        digest = hashlib.sha1(json.dumps(search, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{version}:{digest}"
+
+    def __invalidate(self, version):
+        """
+        Drops the local entries when a new index version is seen.
+        Private method. Not accessible outside the class.
+        """
+        if version != self.__version:
+            if self.__version is not None:
+                self.__entries.clear()
+                self.__stats["invalidations"] += 1
+            self.__version = version
+
+    def get(self, key):
+        """
+        Get a cached response, from the local tier first and then from Redis.
+        :return: cached response or None
+        """
+        version = key.rsplit(":", 1)[0]
+        with self.__lock:
+            self.__invalidate(version)
+
+            entry = self.__entries.get(key)
+            if entry and entry[0] > time.time():
+                self.__entries.move_to_end(key)
+                self.__stats["local_hits"] += 1
+                return entry[1]
+
+            if entry:
+                del self.__entries[key]
+
+        value = None
+        if self.redis:
+            try:
+                value = self.redis.get(self.redis_prefix + key)
+                value = json.loads(value) if value else None
+
+            except (redis.exceptions.RedisError, ValueError) as e:
+                print("Search cache Redis error: ", repr(e))
+                value = None
+
+        with self.__lock:
+            if value is None:
+                self.__stats["misses"] += 1
+                return None
+
+            self.__stats["redis_hits"] += 1
+            self.__set_local(key, value)
+
+        return value
+
+    def __set_local(self, key, value):
+        """
+        Private method. Not accessible outside the class. Caller must hold the lock.
+        """
+        self.__entries[key] = (time.time() + self.ttl, value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def set(self, key, value):
+        """
+        Caches a JSON serializable response in both tiers.
+        """
+        with self.__lock:
+            self.__invalidate(key.rsplit(":", 1)[0])
+            self.__set_local(key, value)
+
+        if self.redis:
+            try:
+                self.redis.setex(self.redis_prefix + key, self.redis_ttl, json.dumps(value))
+
+            except redis.exceptions.RedisError as e:
+                print("Search cache Redis error: ", repr(e))
+
+    def stats(self):
+        """
+        Get the hit and miss counters of the cache.
+        :return: dictionary with local_hits, redis_hits, misses, invalidations, hit_ratio, entries and version
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats["entries"] = len(self.__entries)
+            stats["version"] = self.__version
+
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else 0.0
+
+        return stats
@@ -0,0 +1,760 @@
+import os
+import json
+import math
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+
+class BM25Index:
+    """
+    Inverted index of a corpus for BM25 (Okapi) ranking. Scores are computed with the formulas of
+    rank_bm25.BM25Okapi, bit for bit, but only over the postings of the query terms:
+        idf = log(N - df + 0.5) - log(df + 0.5), negative idf replaced by epsilon * average idf
+        score = sum over query terms of idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avgdl))
+
+    An index built by build_fields ranks documents made of fields with BM25F instead: the term frequency of every
+    field is normalized by the length of the field and boosted, and their sum is saturated once:
+        tf = sum over fields of boost * tf_f / (1 - b_f + b_f * len_f / avgdl_f)
+        score = sum over query terms of idf * tf * (k1 + 1) / (tf + k1)
+
+    The postings of a term are contiguous slices of flat arrays, saved as .npy files and memory mapped on load.
+    offsets, postings_docs and weights are the CSR (compressed sparse row) arrays of the term x document matrix
+    of BM25 weights:
+        offsets[t]:offsets[t + 1]   postings of term t
+        postings_docs               document numbers, ascending within a term
+        postings_tf                 term frequencies
+        postings_rank               rank of the first occurrence of the term in the document, used to reproduce
+                                    the term order of BM25Okapi in the average idf
+        postings_field_tf           term frequencies in every field (fields x postings), BM25F only
+        doc_field_len               lengths of every field of the documents (fields x documents), BM25F only
+        weights                     BM25 score of the term in the document, precomputed with the corpus statistics
+        max_weights                 highest weight of every term, the upper bound of its contribution to a score
+    """
+
+    array_names = ["doc_ids", "doc_len", "offsets", "postings_docs", "postings_tf", "postings_rank", "idf",
+                   "weights", "max_weights", "postings_field_tf", "doc_field_len"]
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25, fields: list = None):
+        """
+        :param fields: list of the {"name": <>, "boost": <>, "b": <>} of the fields of a BM25F index.
+                       b is then per field. Defaults to a BM25 (Okapi) index of single field documents.
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.fields = fields or []
+
+        self.terms = {}
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings_docs = np.zeros(0, dtype=np.int32)
+        self.postings_tf = np.zeros(0, dtype=np.int32)
+        self.postings_rank = np.zeros(0, dtype=np.int32)
+        self.postings_field_tf = np.zeros((len(self.fields), 0), dtype=np.int32)
+        self.doc_field_len = np.zeros((len(self.fields), 0), dtype=np.int32)
+
+        # corpus statistics
+        self.idf = np.zeros(0, dtype=np.float64)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.max_weights = np.zeros(0, dtype=np.float64)
+        self.avgdl = 0.0
+        self.field_avgdl = np.zeros(len(self.fields), dtype=np.float64)
+        self.average_idf = 0.0
+
+        self.meta = {}
+        self.__id_order = None
+        self.__sorted_ids = None
+
+    @property
+    def num_docs(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, corpus, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """
+        Builds the index of a corpus.
+        :param corpus: iterable of strings in "<id> <doc>" format, e.g. FacultyDB().iter_biodata_records().
+                       Documents are split on single spaces and the id is a token of its document, as for Ranker.
+        :return: BM25Index
+        """
+        index = cls(k1, b, epsilon)
+
+        doc_ids, doc_len = [], []
+        term_numbers, docs, tfs, ranks = [], [], [], []
+        for doc in corpus or []:
+            tokens = doc.split(" ")
+            doc_number = len(doc_ids)
+            doc_ids.append(int(tokens[0]))
+            doc_len.append(len(tokens))
+
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+
+            for rank, (token, tf) in enumerate(frequencies.items()):
+                term_numbers.append(index.terms.setdefault(token, len(index.terms)))
+                docs.append(doc_number)
+                tfs.append(tf)
+                ranks.append(rank)
+
+        index.doc_ids = np.array(doc_ids, dtype=np.int64)
+        index.doc_len = np.array(doc_len, dtype=np.int32)
+        index.doc_field_len = np.zeros((0, index.num_docs), dtype=np.int32)
+        index.__set_postings(np.array(term_numbers, dtype=np.int64), np.array(docs, dtype=np.int32),
+                             np.array(tfs, dtype=np.int32), np.array(ranks, dtype=np.int32),
+                             np.zeros((0, len(docs)), dtype=np.int32))
+        return index
+
+    @classmethod
+    def build_fields(cls, records, fields: list, k1: float = 1.5, epsilon: float = 0.25):
+        """
+        Builds the BM25F index of documents made of fields. Document ids are not tokens of the documents.
+        :param records: iterable of (id, list of the tokens of every field) tuples, the fields in the order of fields
+        :param fields: list of the {"name": <>, "boost": <>, "b": <>} of the fields
+        :return: BM25Index
+        """
+        index = cls(k1, 0.0, epsilon, fields)
+        num_fields = len(fields)
+
+        doc_ids, doc_len, doc_field_len = [], [], []
+        term_numbers, docs, tfs, ranks, field_tfs = [], [], [], [], []
+        for doc_id, field_tokens in records or []:
+            doc_number = len(doc_ids)
+            doc_ids.append(int(doc_id))
+            doc_field_len.append([len(tokens) for tokens in field_tokens])
+            doc_len.append(sum(doc_field_len[-1]))
+
+            # term frequencies of every field, the terms in order of first occurrence over the fields
+            frequencies = {}
+            for field, tokens in enumerate(field_tokens):
+                for token in tokens:
+                    if token not in frequencies:
+                        frequencies[token] = [0] * num_fields
+                    frequencies[token][field] += 1
+
+            for rank, (token, field_tf) in enumerate(frequencies.items()):
+                term_numbers.append(index.terms.setdefault(token, len(index.terms)))
+                docs.append(doc_number)
+                tfs.append(sum(field_tf))
+                ranks.append(rank)
+                field_tfs.append(field_tf)
+
+        index.doc_ids = np.array(doc_ids, dtype=np.int64)
+        index.doc_len = np.array(doc_len, dtype=np.int32)
+        index.doc_field_len = np.array(doc_field_len, dtype=np.int32).reshape(-1, num_fields).T.copy()
+        index.__set_postings(np.array(term_numbers, dtype=np.int64), np.array(docs, dtype=np.int32),
+                             np.array(tfs, dtype=np.int32), np.array(ranks, dtype=np.int32),
+                             np.array(field_tfs, dtype=np.int32).reshape(-1, num_fields).T)
+        return index
+
+    @classmethod
+    def merge(cls, indexes: list, live: list = None):
+        """
+        Merges indexes into one, e.g. the segments of BM25Segments. The documents keep their order, the postings
+        are regrouped by term and the corpus statistics are computed again over the merged documents. No document
+        is tokenized again.
+        :param indexes: list of BM25Index, in document order
+        :param live: list of boolean arrays, one per index, of the documents to keep. Defaults to all documents.
+        :return: BM25Index
+        """
+        index = cls(indexes[0].k1, indexes[0].b, indexes[0].epsilon, indexes[0].fields)
+
+        doc_ids, doc_len, doc_field_len = [], [], []
+        term_numbers, docs, tfs, ranks, field_tfs = [], [], [], [], []
+        for i, part in enumerate(indexes):
+            keep = np.ones(part.num_docs, dtype=bool) if live is None else np.asarray(live[i], dtype=bool)
+            numbers = np.cumsum(keep) - 1 + sum(len(part_ids) for part_ids in doc_ids)
+            term_map = np.array([index.terms.setdefault(term, len(index.terms)) for term in part.terms],
+                                dtype=np.int64)
+            kept = keep[part.postings_docs]
+
+            doc_ids.append(part.doc_ids[keep])
+            doc_len.append(part.doc_len[keep])
+            doc_field_len.append(part.doc_field_len[:, keep])
+            term_numbers.append(term_map[np.repeat(np.arange(len(part.terms)), np.diff(part.offsets))[kept]])
+            docs.append(numbers[part.postings_docs[kept]])
+            tfs.append(part.postings_tf[kept])
+            ranks.append(part.postings_rank[kept])
+            field_tfs.append(part.postings_field_tf[:, kept])
+
+        # terms left without documents are dropped
+        term_numbers = np.concatenate(term_numbers)
+        used, term_numbers = np.unique(term_numbers, return_inverse=True)
+        terms = list(index.terms)
+        index.terms = {terms[number]: i for i, number in enumerate(used.tolist())}
+
+        index.doc_ids = np.concatenate(doc_ids).astype(np.int64)
+        index.doc_len = np.concatenate(doc_len).astype(np.int32)
+        index.doc_field_len = np.concatenate(doc_field_len, axis=1).astype(np.int32)
+        index.__set_postings(term_numbers.astype(np.int64), np.concatenate(docs).astype(np.int32),
+                             np.concatenate(tfs).astype(np.int32), np.concatenate(ranks).astype(np.int32),
+                             np.concatenate(field_tfs, axis=1).astype(np.int32))
+        return index
+
+    def __set_postings(self, term_numbers, docs, tfs, ranks, field_tfs):
+        """
+        Groups the postings by term and computes the corpus statistics and the weights.
+        Private method. Not accessible outside the class.
+        :param term_numbers: term of every posting
+        :param docs: document of every posting, ascending for the postings of a term
+        :param tfs: term frequency of every posting
+        :param ranks: rank of the first occurrence of the term in the document of every posting
+        :param field_tfs: term frequency in every field of every posting (fields x postings), BM25F only
+        """
+        # group the postings by term. The sort is stable, so documents stay ascending within a term.
+        order = np.argsort(term_numbers, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(term_numbers, minlength=len(self.terms)))])
+        self.postings_docs = docs[order]
+        self.postings_tf = tfs[order]
+        self.postings_rank = ranks[order]
+        self.postings_field_tf = field_tfs[:, order]
+
+        if self.num_docs:
+            self.avgdl, self.idf, self.average_idf = self.__statistics(np.arange(self.num_docs))
+            self.field_avgdl = self.__field_avgdl(np.arange(self.num_docs))
+            self.weights = self.__weights()
+            self.max_weights = np.maximum.reduceat(self.weights, self.offsets[:-1])
+
+        self.meta = {"created": datetime.now().isoformat(), "num_docs": self.num_docs, "num_terms": len(self.terms)}
+
+    def save(self, index_dir: str, **meta):
+        """
+        Saves the index to a directory. The index is written next to it first and then moved in place,
+        so a reader never loads a partially written index.
+        :param index_dir: index directory
+        :param meta: extra values stored in meta.json, e.g. the data version the index was built from
+        """
+        tmp_dir, old_dir = index_dir.rstrip("/") + ".tmp", index_dir.rstrip("/") + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        for name in self.array_names:
+            np.save(os.path.join(tmp_dir, name + ".npy"), getattr(self, name))
+
+        with open(os.path.join(tmp_dir, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(list(self.terms), f, ensure_ascii=False)
+
+        self.meta.update(meta)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(dict(self.meta, k1=self.k1, b=self.b, epsilon=self.epsilon, fields=self.fields,
+                           avgdl=self.avgdl, field_avgdl=self.field_avgdl.tolist(), average_idf=self.average_idf), f)
+
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True):
+        """
+        Loads an index saved by save.
+        :param index_dir: index directory
+        :param mmap: memory map the arrays instead of reading them, so that loading is immediate and the pages
+                     are shared by the processes using the index
+        :return: BM25Index
+        """
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+
+        index = cls(meta.pop("k1"), meta.pop("b"), meta.pop("epsilon"), meta.pop("fields", None))
+        index.avgdl = meta.pop("avgdl")
+        index.field_avgdl = np.array(meta.pop("field_avgdl", []), dtype=np.float64)
+        index.average_idf = meta.pop("average_idf")
+        index.meta = meta
+
+        for name in cls.array_names:
+            file_path = os.path.join(index_dir, name + ".npy")
+            if os.path.exists(file_path):
+                setattr(index, name, np.load(file_path, mmap_mode="r" if mmap else None))
+
+        # indexes saved before BM25F
+        if not os.path.exists(os.path.join(index_dir, "doc_field_len.npy")):
+            index.postings_field_tf = np.zeros((0, len(index.postings_docs)), dtype=np.int32)
+            index.doc_field_len = np.zeros((0, index.num_docs), dtype=np.int32)
+
+        # indexes saved before the weights were precomputed
+        if not os.path.exists(os.path.join(index_dir, "weights.npy")) and index.num_docs:
+            index.weights = index.__weights()
+        if not os.path.exists(os.path.join(index_dir, "max_weights.npy")) and index.num_docs:
+            index.max_weights = np.maximum.reduceat(index.weights, index.offsets[:-1])
+
+        with open(os.path.join(index_dir, "terms.json"), encoding="utf-8") as f:
+            index.terms = {term: number for number, term in enumerate(json.load(f))}
+
+        return index
+
+    def __statistics(self, docs):
+        """
+        Computes avgdl, idf and average idf over a set of documents, as BM25Okapi does over a corpus of those
+        documents in index order: the idf sum runs over the terms in order of first occurrence.
+        Private method. Not accessible outside the class.
+        :param docs: ascending document numbers
+        :return: tuple of avgdl, idf array of all terms (0 for the terms not in the documents) and average idf
+        """
+        n = len(docs)
+        avgdl = int(self.doc_len[docs].astype(np.int64).sum()) / n
+
+        in_docs = np.zeros(self.num_docs, dtype=bool)
+        in_docs[docs] = True
+        terms, df, positions = first_postings(self.offsets, in_docs[self.postings_docs])
+
+        # terms ordered by the document and the rank in the document of their first posting
+        order = np.lexsort((self.postings_rank[positions], self.postings_docs[positions]))
+        terms, df = terms[order], df[order]
+
+        term_idf, average_idf = idf_of(df, n)
+        term_idf[term_idf < 0] = self.epsilon * average_idf
+
+        idf = np.zeros(len(self.terms), dtype=np.float64)
+        idf[terms] = term_idf
+        return avgdl, idf, average_idf
+
+    def __field_avgdl(self, docs):
+        """
+        Computes the average length of every field over a set of documents.
+        Private method. Not accessible outside the class.
+        :param docs: ascending document numbers
+        :return: array of the average field lengths, empty for a single field index
+        """
+        return self.doc_field_len[:, docs].astype(np.int64).sum(axis=1) / len(docs)
+
+    def __weights(self):
+        """
+        Computes the BM25 weight of every posting with the corpus statistics.
+        Private method. Not accessible outside the class.
+        :return: weights array, aligned with the postings
+        """
+        return self.posting_weights(slice(None), np.repeat(self.idf, np.diff(self.offsets)), self.avgdl,
+                                    self.field_avgdl)
+
+    def posting_weights(self, positions, idf, avgdl: float, field_avgdl=None):
+        """
+        Computes the BM25 weights of postings with some corpus statistics, with the same expression as
+        BM25Okapi.get_scores, so that the weights are equal bit for bit, or with the BM25F expression for an index
+        of fields.
+        :param positions: slice or array of posting positions
+        :param idf: idf of the term of the postings, or array of the idf of every posting
+        :param avgdl: average document length
+        :param field_avgdl: array of the average length of every field, BM25F only
+        :return: weights array, aligned with positions
+        """
+        k1, b = self.k1, self.b
+        if not self.fields:
+            tf, doc_len = self.postings_tf[positions], self.doc_len[self.postings_docs[positions]]
+            return idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avgdl)))
+
+        docs = self.postings_docs[positions]
+        tf = np.zeros(len(docs), dtype=np.float64)
+        for number, field in enumerate(self.fields):
+            # a field empty in all documents has no term frequency to normalize
+            if not field_avgdl[number]:
+                continue
+            field_b = field.get("b", 0.75)
+            tf += field.get("boost", 1.0) * self.postings_field_tf[number][positions] / \
+                (1 - field_b + field_b * self.doc_field_len[number][docs] / field_avgdl[number])
+        return idf * (tf * (k1 + 1) / (tf + k1))
+
+    def __positions(self, doc_ids):
+        """
+        Document numbers of faculty ids. Ids not in the index are ignored.
+        Private method. Not accessible outside the class.
+        :return: ascending document numbers
+        """
+        if self.__id_order is None:
+            # the sorted ids first: the threads sharing the index test __id_order only
+            id_order = np.argsort(self.doc_ids, kind="stable")
+            self.__sorted_ids = np.asarray(self.doc_ids[id_order])
+            self.__id_order = id_order
+
+        ids = np.asarray(list(doc_ids), dtype=np.int64)
+        if not self.num_docs or not len(ids):
+            return np.zeros(0, dtype=np.int64)
+
+        found = np.minimum(np.searchsorted(self.__sorted_ids, ids), self.num_docs - 1)
+        found = found[self.__sorted_ids[found] == ids]
+
+        # ascending and distinct, without sorting the ids
+        in_docs = np.zeros(self.num_docs, dtype=bool)
+        in_docs[self.__id_order[found]] = True
+        return np.flatnonzero(in_docs)
+
+    def __rows(self, tokenized_query: list, docs=None):
+        """
+        Weight rows of the query terms, in query order. Over all documents, these are the precomputed rows;
+        over a subset, the weights are computed with the statistics of the subset: avgdl from the lengths of its
+        documents, and idf from the postings of the query term within the subset. The average idf of the subset,
+        which replaces negative idf, is only computed from the postings of all terms if a query term needs it.
+        Private method. Not accessible outside the class.
+        :return: list of tuples of the document numbers and the weights of a query term
+        """
+        query_terms = [self.terms[term] for term in tokenized_query if term in self.terms]
+
+        if docs is None:
+            return [(self.postings_docs[self.offsets[term]:self.offsets[term + 1]],
+                     self.weights[self.offsets[term]:self.offsets[term + 1]]) for term in query_terms]
+
+        n = len(docs)
+        avgdl = int(self.doc_len[docs].astype(np.int64).sum()) / n
+        field_avgdl = self.__field_avgdl(docs)
+        in_docs = np.zeros(self.num_docs, dtype=bool)
+        in_docs[docs] = True
+
+        rows, term_rows, average_idf = [], {}, None
+        for term in query_terms:
+            if term not in term_rows:
+                start, end = self.offsets[term], self.offsets[term + 1]
+                positions = np.arange(start, end)[in_docs[self.postings_docs[start:end]]]
+                df = len(positions)
+                idf = math.log(n - df + 0.5) - math.log(df + 0.5)
+                if idf < 0:
+                    if average_idf is None:
+                        average_idf = self.__statistics(docs)[2]
+                    idf = self.epsilon * average_idf
+                term_rows[term] = (self.postings_docs[positions],
+                                   self.posting_weights(positions, idf, avgdl, field_avgdl))
+            rows.append(term_rows[term])
+
+        return rows
+
+    def get_scores(self, tokenized_query: list, docs=None):
+        """
+        Scores the documents for the query by summing the weight rows of the query terms.
+        :param tokenized_query: list of query terms. A repeated term counts once per occurrence.
+        :param docs: ascending document numbers to score, with the corpus statistics of these documents only.
+                     Defaults to all documents.
+        :return: scores array of all documents, 0 for the documents without query terms or not in docs
+        """
+        return sum_rows(self.__rows(tokenized_query, docs), self.num_docs)
+
+    def __candidate_scores(self, candidates, query_terms):
+        """
+        Scores of some documents, looking their postings up in the rows of the query terms in query order.
+        Private method. Not accessible outside the class.
+        :param candidates: ascending document numbers
+        :param query_terms: term numbers of the query, in query order
+        :return: scores array aligned with candidates
+        """
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term in query_terms:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            term_docs = self.postings_docs[start:end]
+            positions = np.minimum(np.searchsorted(term_docs, candidates), len(term_docs) - 1)
+            hits = term_docs[positions] == candidates
+            scores[hits] += self.weights[start:end][positions[hits]]
+        return scores
+
+    def __top_n_pruned(self, tokenized_query: list, n: int):
+        """
+        MaxScore top-n over all documents. The terms are taken by descending upper bound, and their documents
+        become candidates until the bounds of the remaining terms add up to less than the n-th best candidate
+        score: a document with none of the taken terms cannot reach the top n, so the postings of the remaining
+        terms are only looked up for the candidates, never scanned.
+        Private method. Not accessible outside the class.
+        :return: ranked document numbers, or None when the scores cannot be bounded (negative idf) or fewer than
+                 n documents score above 0
+        """
+        query_terms = [self.terms[term] for term in tokenized_query if term in self.terms]
+        if not query_terms or self.idf[query_terms].min() < 0:
+            return None
+
+        terms, counts = np.unique(query_terms, return_counts=True)
+        bounds = self.max_weights[terms] * counts
+        order = np.argsort(-bounds, kind="stable")
+        terms, bounds = terms[order], bounds[order]
+        # bound of the score of a document having none of the k first terms, with a margin for rounding
+        remaining = np.concatenate([np.cumsum(bounds[::-1])[::-1][1:], [0.0]]) * (1 + 1e-9)
+
+        candidates = np.zeros(0, dtype=np.int64)
+        for k, term in enumerate(terms.tolist()):
+            candidates = np.union1d(candidates, self.postings_docs[self.offsets[term]:self.offsets[term + 1]])
+            if len(candidates) < n:
+                continue
+
+            scores = self.__candidate_scores(candidates, query_terms)
+            threshold = np.partition(scores, len(candidates) - n)[len(candidates) - n]
+            if threshold <= 0:
+                return None
+            if remaining[k] < threshold:
+                break
+        else:
+            return None
+
+        # the candidates hold every document scoring the threshold or more. Ties keep the last documents.
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[-(n - len(above)):]
+        selected = np.concatenate([above, ties])
+        return candidates[selected[np.lexsort((-candidates[selected], -scores[selected]))]]
+
+    def top_n(self, tokenized_query: list, n: int = 10, doc_ids=None):
+        """
+        Ranks the documents for the query, as np.argsort(scores, kind="stable")[::-1][:n] over the BM25Okapi
+        scores of all documents: by descending score, ties by descending document number. Documents without
+        any query term score 0 and pad the ranking if fewer than n documents match.
+        Over all documents, the postings of common terms are pruned with their score upper bounds (MaxScore).
+        Otherwise, or when pruning does not apply, only the postings of the query terms are read, and the n best
+        are selected with a partition.
+        :param tokenized_query: list of query terms
+        :param n: number of ids to return
+        :param doc_ids: faculty ids to rank, with the corpus statistics of these documents only. Defaults to all.
+        :return: list of faculty ids
+        """
+        docs = None if doc_ids is None else self.__positions(doc_ids)
+        num_docs = self.num_docs if docs is None else len(docs)
+        if not num_docs or n < 1:
+            return []
+
+        if docs is None:
+            ranked = self.__top_n_pruned(tokenized_query, n)
+            if ranked is not None:
+                return self.doc_ids[ranked].tolist()
+
+        ranked = rank_rows(self.__rows(tokenized_query, docs), n, self.num_docs, docs)
+        return self.doc_ids[ranked].tolist()
+
+
+def first_postings(offsets, hits):
+    """
+    Document frequencies and first postings of the terms within a set of documents, without sorting the postings.
+    :param offsets: offsets of the postings of every term
+    :param hits: boolean array of the postings of the documents of the set
+    :return: tuple of the numbers of the terms in the documents, their document frequencies and the positions of
+             their first postings
+    """
+    if np.count_nonzero(hits) * 8 < len(hits):
+        # few hits: term of every hit. The hits of a term are contiguous.
+        hit_postings = np.flatnonzero(hits)
+        hit_terms = np.searchsorted(offsets, hit_postings, side="right") - 1
+        starts = np.flatnonzero(np.diff(hit_terms, prepend=-1))
+        df = np.diff(np.append(starts, len(hit_terms)))
+        return hit_terms[starts], df, hit_postings[starts]
+
+    # hit count before every posting, and at the start and end of every term
+    hit_counts = np.cumsum(hits, dtype=np.int32 if len(hits) < 2 ** 31 else np.int64)
+    counts = np.concatenate([[0], hit_counts])[offsets]
+    df = np.diff(counts)
+    terms = np.flatnonzero(df)
+    return terms, df[terms], np.searchsorted(hit_counts, counts[terms] + 1)
+
+
+def idf_of(df, num_docs: int):
+    """
+    Computes the idf of terms and their average idf as BM25Okapi does, the idf sum running sequentially over the
+    terms in the given order. math.log is taken of every distinct document frequency, as numpy logarithms may differ
+    in the last bit.
+    :param df: array of the document frequencies of the terms
+    :param num_docs: number of documents
+    :return: tuple of the idf array, aligned with df, and the average idf
+    """
+    dfs, df_numbers = np.unique(df, return_inverse=True)
+    log_rest = np.array([math.log(num_docs - value + 0.5) for value in dfs.tolist()])
+    log_df = np.array([math.log(value + 0.5) for value in dfs.tolist()])
+    idf = log_rest[df_numbers] - log_df[df_numbers]
+
+    # sequential sum, in the term order
+    return idf, float(np.cumsum(idf)[-1]) / len(idf)
+
+
+def sum_rows(rows, num_docs: int):
+    """
+    Sums weight rows in order, as BM25Okapi sums the query terms.
+    :param rows: list of tuples of document numbers and weights, in query order
+    :param num_docs: number of documents
+    :return: scores array of all documents
+    """
+    scores = np.zeros(num_docs, dtype=np.float64)
+    for term_docs, weights in rows:
+        scores[term_docs] += weights
+    return scores
+
+
+def rank_rows(rows, n: int, num_docs: int, docs=None):
+    """
+    Ranks documents by the sum of the weight rows of the query terms, as np.argsort(scores, kind="stable")[::-1][:n]
+    over the scores of the ranked documents. Documents without any query term score 0 and pad the ranking.
+    Only the postings of the rows are read, and the n best are selected with a partition.
+    :param rows: list of tuples of document numbers and weights, in query order
+    :param n: number of documents to return
+    :param num_docs: number of documents
+    :param docs: ascending numbers of the documents to rank. Defaults to all documents.
+    :return: array of ranked document numbers
+    """
+    scores = sum_rows(rows, num_docs)
+    num_ranked = num_docs if docs is None else len(docs)
+
+    # scores of the postings. A document has one posting per query term it contains.
+    postings = np.concatenate([term_docs for term_docs, _ in rows] or [[]]).astype(np.int64)
+    posting_scores = scores[postings]
+
+    if len(posting_scores) and posting_scores.min() < 0:
+        # scores below the 0 of the documents without query terms, rank all documents
+        all_docs = np.arange(num_docs) if docs is None else docs
+        return all_docs[np.argsort(scores[all_docs], kind="stable")[::-1][:n]]
+
+    # the n * terms best postings hold the n best documents
+    selected = n * len(rows)
+    if len(postings) > selected:
+        postings_selected = postings[np.argpartition(-posting_scores, selected - 1)[:selected]]
+    else:
+        postings_selected = postings
+    candidates = np.unique(postings_selected)
+    candidates = candidates[scores[candidates] > 0]
+
+    # keep the ties of the n-th score with the last documents
+    if len(candidates) >= n:
+        candidate_scores = scores[candidates]
+        threshold = np.partition(candidate_scores, len(candidates) - n)[len(candidates) - n]
+        above = candidates[candidate_scores > threshold]
+        ties = np.unique(postings[posting_scores == threshold])[-(n - len(above)):]
+        candidates = np.concatenate([above, ties])
+
+    ranked = candidates[np.lexsort((-candidates, -scores[candidates]))][:n]
+
+    # pad with the documents scoring 0, last documents first
+    if len(ranked) < n:
+        missing = min(n, num_ranked) - len(ranked)
+        if docs is None:
+            tail = np.arange(num_docs - 1, max(num_docs - missing - len(ranked), 0) - 1, -1)
+        else:
+            tail = docs[::-1][:missing + len(ranked)]
+        ranked = np.concatenate([ranked, tail[~np.isin(tail, ranked)][:missing]])
+
+    return ranked
+
+
+class BM25Segments:
+    """
+    BM25 (Okapi) ranking over a list of BM25Index segments, e.g. a merged index followed by small indexes of the
+    documents added since. A document deleted or updated after its segment was built stays in the segment and is
+    masked out by the ids deleted from the segment.
+    The statistics (number of documents, avgdl and document frequencies) are those of the live documents of all
+    segments, computed from the postings of the query terms, so that rankings equal BM25Okapi over the live
+    documents in segment order. The average idf replacing negative idf is computed from the postings of all terms,
+    only for the queries having a term of negative idf. Segments of fields are ranked with BM25F, with the average
+    field lengths of the live documents.
+    """
+
+    def __init__(self, segments: list, deleted: list = None):
+        """
+        :param segments: list of BM25Index, in document order
+        :param deleted: list of the faculty ids deleted from every segment
+        """
+        self.segments = segments
+        first = segments[0] if segments else BM25Index()
+        self.k1, self.b, self.epsilon, self.fields = first.k1, first.b, first.epsilon, first.fields
+
+        deleted = deleted if deleted is not None else [[] for _ in segments]
+        self.starts = np.cumsum([0] + [segment.num_docs for segment in segments])[:-1]
+        self.doc_ids = np.concatenate([segment.doc_ids for segment in segments] or [[]]).astype(np.int64)
+        self.doc_len = np.concatenate([segment.doc_len for segment in segments] or [[]]).astype(np.int32)
+        self.doc_field_len = np.concatenate([segment.doc_field_len for segment in segments] or [first.doc_field_len],
+                                            axis=1).astype(np.int32)
+        self.live = np.concatenate([~np.isin(segment.doc_ids, np.asarray(list(ids), dtype=np.int64))
+                                    for segment, ids in zip(segments, deleted)] or [[]]).astype(bool)
+
+        self.__num_terms = 0
+        self.__term_maps = None
+
+    @property
+    def num_docs(self):
+        return len(self.doc_ids)
+
+    def __average_idf(self, in_docs):
+        """
+        Computes the average idf of a set of documents, as BM25Okapi does over a corpus of those documents in
+        segment order: the idf sum runs over the terms in order of first occurrence.
+        Private method. Not accessible outside the class.
+        :param in_docs: boolean array of the documents
+        :return: average idf
+        """
+        if self.__term_maps is None:
+            # term numbers of every segment in a vocabulary of all segments. The number of terms first: the threads
+            # sharing the segments test __term_maps only
+            terms = {}
+            term_maps = [np.array([terms.setdefault(term, len(terms)) for term in segment.terms], dtype=np.int64)
+                         for segment in self.segments]
+            self.__num_terms = len(terms)
+            self.__term_maps = term_maps
+
+        # document frequency and first occurrence (document and rank in the document) of every term
+        rank_bound = int(self.doc_len.max()) + 1
+        df = np.zeros(self.__num_terms, dtype=np.int64)
+        first = np.full(self.__num_terms, -1, dtype=np.int64)
+        for segment, start, term_map in zip(self.segments, self.starts, self.__term_maps):
+            terms, segment_df, positions = first_postings(segment.offsets,
+                                                          in_docs[segment.postings_docs.astype(np.int64) + start])
+            terms = term_map[terms]
+            df[terms] += segment_df
+
+            # the earlier segments hold the earlier documents
+            keys = (segment.postings_docs[positions].astype(np.int64) + start) * rank_bound + \
+                segment.postings_rank[positions]
+            new = first[terms] < 0
+            first[terms[new]] = keys[new]
+
+        terms = np.flatnonzero(df)
+        terms = terms[np.argsort(first[terms])]
+        return idf_of(df[terms], int(in_docs.sum()))[1]
+
+    def __postings(self, term: str, in_docs):
+        """
+        Postings of a term in the documents of in_docs of all segments.
+        Private method. Not accessible outside the class.
+        :return: list of tuples of the segment, the document numbers and the posting positions in the segment
+        """
+        postings = []
+        for segment, start in zip(self.segments, self.starts):
+            number = segment.terms.get(term)
+            if number is None:
+                continue
+            begin, end = segment.offsets[number], segment.offsets[number + 1]
+            segment_docs = segment.postings_docs[begin:end].astype(np.int64) + start
+            mask = in_docs[segment_docs]
+            postings.append((segment, segment_docs[mask], np.arange(begin, end)[mask]))
+        return postings
+
+    def top_n(self, tokenized_query: list, n: int = 10, doc_ids=None):
+        """
+        Ranks the live documents for the query, see BM25Index.top_n. A single segment without deleted documents
+        is ranked by the segment itself.
+        :param tokenized_query: list of query terms
+        :param n: number of ids to return
+        :param doc_ids: faculty ids to rank, with the corpus statistics of these documents only. Defaults to all.
+        :return: list of faculty ids
+        """
+        if len(self.segments) == 1 and self.live.all():
+            return self.segments[0].top_n(tokenized_query, n, doc_ids)
+
+        in_docs = self.live
+        if doc_ids is not None:
+            in_docs = in_docs & np.isin(self.doc_ids, np.asarray(list(doc_ids), dtype=np.int64))
+        docs = np.flatnonzero(in_docs)
+        if not len(docs) or n < 1:
+            return []
+
+        num_docs = len(docs)
+        avgdl = int(self.doc_len[docs].astype(np.int64).sum()) / num_docs
+        field_avgdl = self.doc_field_len[:, docs].astype(np.int64).sum(axis=1) / num_docs
+
+        rows, query_rows, average_idf = {}, [], None
+        for term in tokenized_query:
+            if term not in rows:
+                postings = self.__postings(term, in_docs)
+                df = sum(len(term_docs) for _, term_docs, _ in postings)
+                rows[term] = None
+                if df:
+                    idf = math.log(num_docs - df + 0.5) - math.log(df + 0.5)
+                    if idf < 0:
+                        if average_idf is None:
+                            average_idf = self.__average_idf(in_docs)
+                        idf = self.epsilon * average_idf
+                    rows[term] = (np.concatenate([term_docs for _, term_docs, _ in postings]),
+                                  np.concatenate([segment.posting_weights(positions, idf, avgdl, field_avgdl)
+                                                  for segment, _, positions in postings]))
+            if rows[term] is not None:
+                query_rows.append(rows[term])
+
+        return self.doc_ids[rank_rows(query_rows, n, self.num_docs, docs)].tolist()
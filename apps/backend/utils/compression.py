@@ -0,0 +1,47 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_codecs():
+    """
+    Get the codecs usable in this environment. zstd needs the optional zstandard package.
+    :return: list of codec names
+    """
+    return ["zlib", "zstd"] if zstandard else ["zlib"]
+
+
+def compress_text(text: str, codec: str = "zlib", level: int = 6):
+    """
+    Compresses a text with the codec. Falls back to zlib if the codec is not available.
+    :param text: text to compress
+    :param codec: "zlib" or "zstd"
+    :param level: compression level
+    :return: tuple of the codec used and the compressed bytes
+    """
+    data = (text or "").encode("utf-8")
+    if codec == "zstd" and zstandard:
+        return "zstd", zstandard.ZstdCompressor(level=level).compress(data)
+
+    return "zlib", zlib.compress(data, level)
+
+
+def decompress_text(data: bytes, codec: str = "zlib"):
+    """
+    Decompresses a text compressed by compress_text.
+    :param data: compressed bytes
+    :param codec: codec the text was compressed with
+    :return: text or None if there is no data
+    """
+    if data is None:
+        return None
+
+    if codec == "zstd":
+        if not zstandard:
+            raise Exception("zstd compressed data found but the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+
+    return zlib.decompress(data).decode("utf-8")
@@ -0,0 +1,106 @@
+import re
+import hashlib
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# query parameters that do not change the page served
+TRACKING_PARAMS = {"utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content", "fbclid", "gclid"}
+
+# directory index pages served for the directory url itself
+INDEX_PAGES = {"index.html", "index.htm", "index.php", "default.aspx", "default.asp"}
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+
+
+def canonicalize_url(url: str):
+    """
+    Canonical form of a faculty homepage url, equal for the url variants serving the same page:
+    scheme (http or https), letter case of the host, www. prefix, default port, repeated or trailing
+    slashes, directory index page, fragment, tracking parameters and order of the query parameters.
+    :param url: url as crawled
+    :return: canonical url string without scheme, e.g. "smu.edu.in/content/smu/faculty.html"
+    """
+    url = (url or "").strip()
+    if not url:
+        return url
+
+    if url.startswith("//"):
+        url = "http:" + url
+    elif "://" not in url:
+        url = "http://" + url
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host += f":{parts.port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path)
+    segments = path.split("/")
+    if segments[-1].lower() in INDEX_PAGES:
+        segments[-1] = ""
+    path = "/".join(segments).rstrip("/")
+
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in TRACKING_PARAMS)
+
+    return host + path + ("?" + urlencode(query) if query else "")
+
+
+def simhash(text: str, bits: int = SIMHASH_BITS):
+    """
+    SimHash fingerprint of a text. Texts sharing most of their words get fingerprints differing in few bits.
+    :param text: text to fingerprint
+    :param bits: fingerprint length, at most 64
+    :return: tuple of the unsigned fingerprint and the number of tokens it was computed from
+    """
+    tokens = re.findall(r"\w+", (text or "").lower())
+    weights = [0] * bits
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+
+    for token, count in counts.items():
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += count if h >> bit & 1 else -count
+
+    fingerprint = 0
+    for bit in range(bits):
+        if weights[bit] > 0:
+            fingerprint |= 1 << bit
+
+    return fingerprint, len(tokens)
+
+
+def simhash_bands(fingerprint: int, bands: int = SIMHASH_BANDS, bits: int = SIMHASH_BITS):
+    """
+    Splits a fingerprint in equal bands. Fingerprints within bands - 1 bits of each other share at least one band,
+    so near duplicate candidates are found by exact lookups of the bands.
+    :return: list of band values
+    """
+    width = bits // bands
+    mask = (1 << width) - 1
+    return [fingerprint >> (i * width) & mask for i in range(bands)]
+
+
+def hamming_distance(a: int, b: int):
+    """
+    Number of differing bits of two fingerprints.
+    """
+    return bin(a ^ b).count("1")
+
+
+def to_signed64(value: int):
+    """
+    Unsigned 64 bit integer to the signed value stored by SQLite3.
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed64(value: int):
+    """
+    Signed 64 bit integer stored by SQLite3 to the unsigned value.
+    """
+    return value + (1 << 64) if value < 0 else value
@@ -1,46 +1,355 @@
 import os
+import re
 import json
+import string
+import hashlib
 import sqlite3
+import threading
+import time
 from datetime import datetime
 from sqlite3 import Error
+from urllib.request import pathname2url
 
 from apps.backend.api.elasticsearchapi import ElasticSearchAPI
+from apps.backend.utils.compression import compress_text, decompress_text
+from apps.backend.utils.dedup import (SIMHASH_BANDS, canonicalize_url, simhash, simhash_bands, hamming_distance,
+                                      to_signed64, from_signed64)
+from apps.backend.utils.settings import get_config
 
+# one SQLite3 connection per thread, reused by all FacultyDB instances of the thread
+_local = threading.local()
 
-class FacultyDB:
+# database files whose schema was already created by this process
+_schema_lock = threading.Lock()
+_schema_created = set()
 
-    def __init__(self):
-        pass
+# facet values served by get_facet_values, per database file and snapshot mode
+_facet_lock = threading.Lock()
+_facet_cache = {}
 
-    def __open_connection(self):
-        """
-        Creates a SQLite3 database and opens a connection. Also creates tables if not present.
-        Private method. Not accessible outside the class.
-        :return:
-        """
-        conn = json_data = None
+# case folding of the NOCASE collation of SQLite3: ASCII letters only
+_NOCASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
-        dirname = os.path.dirname(__file__)
-        config_file = os.path.join(dirname, '../../../config/config.json')
 
-        with open(config_file, "r") as jsonfile:
-            json_data = json.load(jsonfile)
+def _execute_script(conn, script: str):
+    """
+    Executes the statements of a SQL script one by one in the current transaction. executescript commits the
+    pending transaction first, which would split a migration from its version number.
+    :param conn: sqlite3 connection
+    :param script: semicolon separated SQL statements
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
 
-        db_file = json_data.get("database", {}).get("db_filename", "")
-        db_file = os.path.join(dirname, "../../../data/sqlite3/" + db_file)
 
-        # create database and open a conection
-        try:
-            conn = sqlite3.connect(db_file)
-            # print(sqlite3.version)
+class FacultyDB:
 
-        except Error as e:
-            raise Exception("Unexpected SQLite3 database connection error: " + str(e))
+    def __init__(self, snapshot: bool = None):
+        """
+        :param snapshot: read from the latest read-only snapshot instead of the database written by the crawler.
+                         Defaults to database.snapshots.read of the configuration. Writes always go to the database.
+        """
+        database_config = get_config("database")
+        dirname = os.path.dirname(__file__)
+        self.db_file = os.path.join(dirname, "../../../data/sqlite3/" + database_config.get("db_filename", ""))
+        self.pragmas = database_config.get("pragmas", {})
+
+        # versioned read-only copies of the database, see create_snapshot
+        snapshot_config = database_config.get("snapshots", {})
+        self.snapshot_dir = os.path.join(dirname, "../../../data/sqlite3/",
+                                         snapshot_config.get("dirname", "snapshots"))
+        self.snapshot_keep = snapshot_config.get("keep", 3)
+        self.snapshot_after_add = snapshot_config.get("create_after_add", False)
+        self.snapshot = snapshot_config.get("read", False) if snapshot is None else snapshot
+        self.biodata_codec = database_config.get("biodata_codec", "zlib")
+        self.facet_check_interval = database_config.get("facet_check_interval", 5)
+
+        # the faculty_fts full text index is maintained by triggers for the sqlite_fts search backend only
+        self.fts_enabled = get_config("search").get("backend", "elasticsearch") == "sqlite_fts"
+
+        # near duplicate detection. SimHash candidates share a band, so the threshold must stay below the 4 bands.
+        dedup_config = get_config("dedup")
+        self.dedup_simhash_threshold = min(dedup_config.get("simhash_threshold", 3), SIMHASH_BANDS - 1)
+        self.dedup_min_tokens = dedup_config.get("min_tokens", 50)
+
+        # changes applied to the prebuilt BM25 index of the Ranker, see Ranker.update
+        self.ranker_update_after_add = get_config("ranker").get("update_after_add", True)
+
+        # columns of a faculty record
+        self.faculty_columns = ["id", "faculty_name", "faculty_homepage_url", "faculty_department_url",
+                                "faculty_department_name", "faculty_university_url", "faculty_university_name",
+                                "faculty_email", "faculty_phone", "faculty_location", "faculty_expertise",
+                                "faculty_biodata"]
+
+    def __create_tables(self, conn):
+        """
+        Migrates the schema to the latest version, then creates the triggers, views and indexes if not present.
+        Runs once per process and database file.
+        Private method. Not accessible outside the class.
+        """
+        # change log of faculty_info rows used for the incremental search index sync
+        create_faculty_change_log_triggers_sql = """
+        CREATE TRIGGER IF NOT EXISTS faculty_info_after_insert AFTER INSERT ON faculty_info
+        BEGIN
+            INSERT INTO faculty_change_log (faculty_id, operation, changed_at)
+            VALUES (NEW.id, 'upsert', NEW.last_modified_at);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_info_after_update AFTER UPDATE ON faculty_info
+        BEGIN
+            INSERT INTO faculty_change_log (faculty_id, operation, changed_at)
+            VALUES (NEW.id, 'upsert', NEW.last_modified_at);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_info_after_delete AFTER DELETE ON faculty_info
+        BEGIN
+            INSERT INTO faculty_change_log (faculty_id, operation, changed_at)
+            VALUES (OLD.id, 'delete', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+        END;"""
+
+        # case insensitive indexes of the filter columns, and the modification time index of the time range queries
+        create_faculty_info_indexes_sql = """
+        CREATE INDEX IF NOT EXISTS faculty_info_university_name_idx
+            ON faculty_info (faculty_university_name COLLATE NOCASE);
+
+        CREATE INDEX IF NOT EXISTS faculty_info_department_name_idx
+            ON faculty_info (faculty_department_name COLLATE NOCASE);
+
+        CREATE INDEX IF NOT EXISTS faculty_info_location_idx
+            ON faculty_info (faculty_location COLLATE NOCASE);
+
+        CREATE INDEX IF NOT EXISTS faculty_info_last_modified_at_idx
+            ON faculty_info (last_modified_at);"""
+
+        # biodata joined back to faculty_info for the full text index
+        create_faculty_fts_content_view_sql = """
+        CREATE VIEW IF NOT EXISTS faculty_fts_content AS
+        SELECT  f.id,
+                f.faculty_name,
+                faculty_decompress(b.codec, b.biodata) AS faculty_biodata,
+                f.faculty_expertise,
+                f.faculty_department_name,
+                f.faculty_university_name,
+                f.faculty_location
+          FROM  faculty_info f
+     LEFT JOIN  faculty_biodata b ON b.faculty_id = f.id;"""
+
+        # full text index over the searched columns, kept in sync with faculty_info and faculty_biodata by triggers.
+        # faculty_info is written before faculty_biodata, so the biodata triggers replace the row indexed
+        # with the previous biodata.
+        create_faculty_fts_table_sql = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS faculty_fts USING fts5 (
+            faculty_name,
+            faculty_biodata,
+            faculty_expertise,
+            faculty_department_name,
+            faculty_university_name,
+            faculty_location,
+            content='faculty_fts_content',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS faculty_fts_after_insert AFTER INSERT ON faculty_info
+        BEGIN
+            INSERT INTO faculty_fts (rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            VALUES (NEW.id, NEW.faculty_name,
+                    (SELECT faculty_decompress(codec, biodata) FROM faculty_biodata WHERE faculty_id = NEW.id),
+                    NEW.faculty_expertise, NEW.faculty_department_name, NEW.faculty_university_name,
+                    NEW.faculty_location);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_fts_after_delete AFTER DELETE ON faculty_info
+        BEGIN
+            INSERT INTO faculty_fts (faculty_fts, rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            VALUES ('delete', OLD.id, OLD.faculty_name,
+                    (SELECT faculty_decompress(codec, biodata) FROM faculty_biodata WHERE faculty_id = OLD.id),
+                    OLD.faculty_expertise, OLD.faculty_department_name, OLD.faculty_university_name,
+                    OLD.faculty_location);
+            DELETE FROM faculty_biodata WHERE faculty_id = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_fts_after_update AFTER UPDATE ON faculty_info
+        BEGIN
+            INSERT INTO faculty_fts (faculty_fts, rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            VALUES ('delete', OLD.id, OLD.faculty_name,
+                    (SELECT faculty_decompress(codec, biodata) FROM faculty_biodata WHERE faculty_id = OLD.id),
+                    OLD.faculty_expertise, OLD.faculty_department_name, OLD.faculty_university_name,
+                    OLD.faculty_location);
+            INSERT INTO faculty_fts (rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            VALUES (NEW.id, NEW.faculty_name,
+                    (SELECT faculty_decompress(codec, biodata) FROM faculty_biodata WHERE faculty_id = NEW.id),
+                    NEW.faculty_expertise, NEW.faculty_department_name, NEW.faculty_university_name,
+                    NEW.faculty_location);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_biodata_after_insert AFTER INSERT ON faculty_biodata
+        BEGIN
+            INSERT INTO faculty_fts (faculty_fts, rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            SELECT  'delete', id, faculty_name, NULL, faculty_expertise, faculty_department_name,
+                    faculty_university_name, faculty_location
+              FROM  faculty_info
+             WHERE  id = NEW.faculty_id;
+            INSERT INTO faculty_fts (rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            SELECT  id, faculty_name, faculty_decompress(NEW.codec, NEW.biodata), faculty_expertise,
+                    faculty_department_name, faculty_university_name, faculty_location
+              FROM  faculty_info
+             WHERE  id = NEW.faculty_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_biodata_after_update AFTER UPDATE ON faculty_biodata
+        BEGIN
+            INSERT INTO faculty_fts (faculty_fts, rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            SELECT  'delete', id, faculty_name, faculty_decompress(OLD.codec, OLD.biodata), faculty_expertise,
+                    faculty_department_name, faculty_university_name, faculty_location
+              FROM  faculty_info
+             WHERE  id = OLD.faculty_id;
+            INSERT INTO faculty_fts (rowid, faculty_name, faculty_biodata, faculty_expertise,
+                                     faculty_department_name, faculty_university_name, faculty_location)
+            SELECT  id, faculty_name, faculty_decompress(NEW.codec, NEW.biodata), faculty_expertise,
+                    faculty_department_name, faculty_university_name, faculty_location
+              FROM  faculty_info
+             WHERE  id = NEW.faculty_id;
+        END;"""
+
+        # the full text index is only maintained for the sqlite_fts search backend
+        drop_faculty_fts_sql = """
+        DROP TRIGGER IF EXISTS faculty_fts_after_insert;
+        DROP TRIGGER IF EXISTS faculty_fts_after_delete;
+        DROP TRIGGER IF EXISTS faculty_fts_after_update;
+        DROP TRIGGER IF EXISTS faculty_biodata_after_insert;
+        DROP TRIGGER IF EXISTS faculty_biodata_after_update;
+        DROP TABLE IF EXISTS faculty_fts;
+        DROP VIEW IF EXISTS faculty_fts_content;"""
+
+        # biodata of a deleted faculty. With the full text index, faculty_fts_after_delete removes it once unindexed.
+        create_faculty_biodata_delete_trigger_sql = """
+        CREATE TRIGGER IF NOT EXISTS faculty_biodata_after_faculty_delete AFTER DELETE ON faculty_info
+        BEGIN
+            DELETE FROM faculty_biodata WHERE faculty_id = OLD.id;
+        END;"""
+
+        # lookups of the duplicate detection
+        create_faculty_fingerprint_indexes_sql = """
+        CREATE INDEX IF NOT EXISTS faculty_fingerprint_canonical_url_idx ON faculty_fingerprint (canonical_url);
+        CREATE INDEX IF NOT EXISTS faculty_fingerprint_band0_idx ON faculty_fingerprint (band0);
+        CREATE INDEX IF NOT EXISTS faculty_fingerprint_band1_idx ON faculty_fingerprint (band1);
+        CREATE INDEX IF NOT EXISTS faculty_fingerprint_band2_idx ON faculty_fingerprint (band2);
+        CREATE INDEX IF NOT EXISTS faculty_fingerprint_band3_idx ON faculty_fingerprint (band3);
+
+        CREATE TRIGGER IF NOT EXISTS faculty_fingerprint_after_delete AFTER DELETE ON faculty_info
+        BEGIN
+            DELETE FROM faculty_fingerprint WHERE faculty_id = OLD.id;
+        END;"""
+
+        # faculty counts per university, department and location
+        create_faculty_facet_counts_triggers_sql = """
+        CREATE TRIGGER IF NOT EXISTS faculty_facets_after_insert AFTER INSERT ON faculty_info
+        BEGIN
+            INSERT INTO faculty_facet_counts (facet, value, count)
+            VALUES ('university', NEW.faculty_university_name, 1),
+                   ('department', NEW.faculty_department_name, 1),
+                   ('location', NEW.faculty_location, 1)
+            ON CONFLICT (facet, value) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_facets_after_delete AFTER DELETE ON faculty_info
+        BEGIN
+            UPDATE  faculty_facet_counts
+               SET  count = count - 1
+             WHERE  (facet = 'university' AND value = OLD.faculty_university_name)
+                OR  (facet = 'department' AND value = OLD.faculty_department_name)
+                OR  (facet = 'location' AND value = OLD.faculty_location);
+            DELETE FROM faculty_facet_counts WHERE count <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS faculty_facets_after_update
+        AFTER UPDATE OF faculty_university_name, faculty_department_name, faculty_location ON faculty_info
+        BEGIN
+            UPDATE  faculty_facet_counts
+               SET  count = count - 1
+             WHERE  (facet = 'university' AND value = OLD.faculty_university_name)
+                OR  (facet = 'department' AND value = OLD.faculty_department_name)
+                OR  (facet = 'location' AND value = OLD.faculty_location);
+            INSERT INTO faculty_facet_counts (facet, value, count)
+            VALUES ('university', NEW.faculty_university_name, 1),
+                   ('department', NEW.faculty_department_name, 1),
+                   ('location', NEW.faculty_location, 1)
+            ON CONFLICT (facet, value) DO UPDATE SET count = count + 1;
+            DELETE FROM faculty_facet_counts WHERE count <= 0;
+        END;"""
+
+        with _schema_lock:
+            if (os.getpid(), self.db_file) in _schema_created:
+                return
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 table creation error: " + str(e))
+            try:
+                c = conn.cursor()
+
+                # schema versions not applied yet, in order. Every migration runs in one write transaction with
+                # the version bump, and the version is read again once the write lock is held: another process
+                # (crawler or web server) may have migrated meanwhile.
+                migrations = [self.__migrate_to_v1, self.__migrate_to_v2]
+                version = c.execute("PRAGMA user_version").fetchone()[0]
+                for number, migration in enumerate(migrations, start=1):
+                    if version < number:
+                        c.execute("BEGIN IMMEDIATE")
+                        version = c.execute("PRAGMA user_version").fetchone()[0]
+                        if version < number:
+                            print(f"Migrating database schema to version {number}.")
+                            migration(conn)
+                            c.execute(f"PRAGMA user_version = {number}")
+                            version = number
+                        conn.commit()
+
+                c.executescript(create_faculty_change_log_triggers_sql)
+                c.executescript(create_faculty_info_indexes_sql)
+
+                if self.fts_enabled:
+                    c.execute("DROP TRIGGER IF EXISTS faculty_biodata_after_faculty_delete")
+                    c.executescript(create_faculty_fts_content_view_sql)
+
+                    # index the rows that were stored before the full text index existed, or while it was off
+                    has_fts = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'faculty_fts'").fetchone()
+                    c.executescript(create_faculty_fts_table_sql)
+                    if not has_fts:
+                        c.execute("INSERT INTO faculty_fts (faculty_fts) VALUES ('rebuild')")
+                        conn.commit()
+
+                else:
+                    # no upsert pays for decompressing the biodata in to an index nothing reads
+                    c.executescript(drop_faculty_fts_sql)
+                    c.executescript(create_faculty_biodata_delete_trigger_sql)
+
+                c.executescript(create_faculty_fingerprint_indexes_sql)
+                c.executescript(create_faculty_facet_counts_triggers_sql)
+
+            except Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise Exception("Unexpected SQLite3 table creation error: " + str(e))
+
+            _schema_created.add((os.getpid(), self.db_file))
 
-        create_faculty_info_table_sql = """ 
+    def __migrate_to_v1(self, conn):
+        """
+        Schema version 1: the tables created by the releases before the schema was versioned. Every step is
+        idempotent, so databases created by any of these releases are brought to the same state.
+        Runs in the transaction of the caller.
+        Private method. Not accessible outside the class.
+        """
+        create_faculty_info_table_sql = """
         CREATE TABLE IF NOT EXISTS faculty_info (
             id integer PRIMARY KEY,
             faculty_name text NOT NULL,
@@ -55,25 +364,357 @@ class FacultyDB:
             faculty_expertise text NOT NULL,
             faculty_biodata NOT NULL,
             last_modified_date text NOT NULL,
-            created_date text NOT NULL
+            created_date text NOT NULL,
+            content_hash text
+        );"""
+
+        create_faculty_change_log_table_sql = """
+        CREATE TABLE IF NOT EXISTS faculty_change_log (
+            change_id integer PRIMARY KEY AUTOINCREMENT,
+            faculty_id integer NOT NULL,
+            operation text NOT NULL,
+            last_modified_date text NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS search_sync_state (
+            name text PRIMARY KEY,
+            last_change_id integer NOT NULL
+        );"""
+
+        # biodata compressed in a side table, so that faculty_info rows stay small
+        create_faculty_biodata_table_sql = """
+        CREATE TABLE IF NOT EXISTS faculty_biodata (
+            faculty_id integer PRIMARY KEY,
+            codec text NOT NULL,
+            biodata blob NOT NULL
+        );"""
+
+        # full text index of older releases, built on faculty_info.faculty_biodata
+        drop_faculty_info_fts_sql = """
+        DROP TRIGGER IF EXISTS faculty_fts_after_insert;
+        DROP TRIGGER IF EXISTS faculty_fts_after_delete;
+        DROP TRIGGER IF EXISTS faculty_fts_after_update;
+        DROP TABLE IF EXISTS faculty_fts;"""
+
+        # canonical url and biodata SimHash of every faculty, used to detect duplicates at insert time.
+        # The 64 bit SimHash is also stored as 4 bands of 16 bits, looked up by index.
+        create_faculty_fingerprint_table_sql = """
+        CREATE TABLE IF NOT EXISTS faculty_fingerprint (
+            faculty_id integer PRIMARY KEY,
+            canonical_url text NOT NULL,
+            simhash integer,
+            band0 integer,
+            band1 integer,
+            band2 integer,
+            band3 integer
         );"""
 
-        # create tables if not present
+        # faculty counts per university, department and location, maintained by triggers
+        create_faculty_facet_counts_table_sql = """
+        CREATE TABLE faculty_facet_counts (
+            facet text NOT NULL,
+            value text NOT NULL,
+            count integer NOT NULL,
+            PRIMARY KEY (facet, value)
+        );
+
+        INSERT INTO faculty_facet_counts (facet, value, count)
+        SELECT 'university', faculty_university_name, COUNT(*) FROM faculty_info GROUP BY faculty_university_name
+        UNION ALL
+        SELECT 'department', faculty_department_name, COUNT(*) FROM faculty_info GROUP BY faculty_department_name
+        UNION ALL
+        SELECT 'location', faculty_location, COUNT(*) FROM faculty_info GROUP BY faculty_location;"""
+
+        c = conn.cursor()
+        c.execute(create_faculty_info_table_sql)
+
+        columns = [column[1] for column in c.execute("PRAGMA table_info(faculty_info)")]
+        if "content_hash" not in columns:
+            c.execute("ALTER TABLE faculty_info ADD COLUMN content_hash text")
+
+        _execute_script(conn, create_faculty_change_log_table_sql)
+        _execute_script(conn, create_faculty_biodata_table_sql)
+
+        fts_sql = c.execute("SELECT sql FROM sqlite_master WHERE name = 'faculty_fts'").fetchone()
+        if fts_sql and "faculty_fts_content" not in fts_sql[0]:
+            _execute_script(conn, drop_faculty_info_fts_sql)
+
+        self.__migrate_biodata(conn)
+
+        _execute_script(conn, create_faculty_fingerprint_table_sql)
+        self.__migrate_fingerprints(conn)
+
+        if not c.execute("SELECT 1 FROM sqlite_master WHERE name = 'faculty_facet_counts'").fetchone():
+            _execute_script(conn, create_faculty_facet_counts_table_sql)
+
+    def __migrate_to_v2(self, conn):
+        """
+        Schema version 2: typed columns. faculty_info and faculty_change_log are rebuilt with the creation and
+        modification times as integer milliseconds since the epoch instead of text, typed location column and
+        without the biodata column (the biodata lives in faculty_biodata). The sync state records the sync time.
+        Triggers and views are dropped and recreated by __create_tables from their current definitions.
+        Runs in the transaction of the caller.
+        Private method. Not accessible outside the class.
+        """
+        rebuild_tables_sql = """
+        CREATE TABLE faculty_info_v2 (
+            id integer PRIMARY KEY,
+            faculty_name text NOT NULL,
+            faculty_homepage_url text NOT NULL UNIQUE,
+            faculty_department_url text NOT NULL,
+            faculty_department_name text NOT NULL,
+            faculty_university_url text NOT NULL,
+            faculty_university_name text NOT NULL,
+            faculty_email text,
+            faculty_phone text,
+            faculty_location text NOT NULL,
+            faculty_expertise text NOT NULL,
+            content_hash text,
+            created_at integer NOT NULL,
+            last_modified_at integer NOT NULL
+        );
+
+        INSERT INTO faculty_info_v2
+        SELECT  id, faculty_name, faculty_homepage_url, faculty_department_url, faculty_department_name,
+                faculty_university_url, faculty_university_name, faculty_email, faculty_phone, faculty_location,
+                faculty_expertise, content_hash, faculty_epoch_ms(created_date), faculty_epoch_ms(last_modified_date)
+          FROM  faculty_info;
+
+        DROP TABLE faculty_info;
+        ALTER TABLE faculty_info_v2 RENAME TO faculty_info;
+
+        CREATE TABLE faculty_change_log_v2 (
+            change_id integer PRIMARY KEY AUTOINCREMENT,
+            faculty_id integer NOT NULL,
+            operation text NOT NULL,
+            changed_at integer NOT NULL
+        );
+
+        -- keep the change sequence growing, it is the data version of get_data_version
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'faculty_change_log_v2', seq FROM sqlite_sequence WHERE name = 'faculty_change_log';
+
+        INSERT INTO faculty_change_log_v2
+        SELECT change_id, faculty_id, operation, faculty_epoch_ms(last_modified_date) FROM faculty_change_log;
+
+        DROP TABLE faculty_change_log;
+        ALTER TABLE faculty_change_log_v2 RENAME TO faculty_change_log;
+
+        ALTER TABLE search_sync_state ADD COLUMN synced_at integer;"""
+
+        def epoch_ms(text):
+            try:
+                return int(datetime.fromisoformat(text).timestamp() * 1000)
+            except (TypeError, ValueError):
+                return 0
+
+        conn.create_function("faculty_epoch_ms", 1, epoch_ms, deterministic=True)
+
+        # the triggers and views reference the rebuilt tables, which can not be renamed while they are dangling
+        triggers_and_views = conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('trigger', 'view')")
+        for name, type in triggers_and_views.fetchall():
+            conn.execute(f"DROP {type.upper()} IF EXISTS {name}")
+        _execute_script(conn, rebuild_tables_sql)
+
+    def __migrate_biodata(self, conn, batch_size: int = 500):
+        """
+        Moves biodata stored in faculty_info by older releases to the compressed faculty_biodata table.
+        Runs in the transaction of the caller.
+        Private method. Not accessible outside the class.
+        """
+        moved = 0
+        while True:
+            rows = conn.execute("SELECT id, faculty_biodata FROM faculty_info WHERE faculty_biodata != '' LIMIT ?",
+                                (batch_size,)).fetchall()
+            if not rows:
+                break
+
+            conn.executemany("INSERT OR REPLACE INTO faculty_biodata (faculty_id, codec, biodata) VALUES (?,?,?)",
+                             [(id,) + compress_text(biodata, self.biodata_codec) for id, biodata in rows])
+            conn.executemany("UPDATE faculty_info SET faculty_biodata = '' WHERE id = ?", [(id,) for id, _ in rows])
+            moved += len(rows)
+
+        if moved:
+            print(f"{moved} biodata record(s) moved to the compressed faculty_biodata table.")
+
+    def __fingerprint(self, faculty_homepage_url: str, faculty_biodata: str):
+        """
+        Canonical url and SimHash bands of a faculty, in faculty_fingerprint column order.
+        The SimHash is left out for biodata too short to tell faculty apart.
+        Private method. Not accessible outside the class.
+        """
+        fingerprint, n_tokens = simhash(faculty_biodata)
+        if n_tokens < self.dedup_min_tokens:
+            return (canonicalize_url(faculty_homepage_url), None, None, None, None, None)
+
+        return (canonicalize_url(faculty_homepage_url), to_signed64(fingerprint)) + tuple(simhash_bands(fingerprint))
+
+    def __migrate_fingerprints(self, conn, batch_size: int = 500):
+        """
+        Fingerprints the faculty stored before duplicate detection existed.
+        Runs in the transaction of the caller.
+        Private method. Not accessible outside the class.
+        """
+        added = 0
+        while True:
+            rows = conn.execute("""
+            SELECT  f.id, f.faculty_homepage_url, b.codec, b.biodata
+              FROM  faculty_info f
+         LEFT JOIN  faculty_biodata b ON b.faculty_id = f.id
+             WHERE  f.id NOT IN (SELECT faculty_id FROM faculty_fingerprint)
+             LIMIT  ?""", (batch_size,)).fetchall()
+            if not rows:
+                break
+
+            conn.executemany("INSERT INTO faculty_fingerprint VALUES (?,?,?,?,?,?,?)",
+                             [(id,) + self.__fingerprint(url, decompress_text(biodata, codec))
+                              for id, url, codec, biodata in rows])
+            added += len(rows)
+
+        if added:
+            print(f"{added} faculty record(s) fingerprinted for duplicate detection.")
+
+    def __find_duplicate(self, conn, fingerprint: tuple, seen_urls: dict, seen_bands: dict):
+        """
+        Finds the faculty a crawled record duplicates: first a faculty with the same canonical url, then a faculty
+        whose biodata SimHash is within dedup_simhash_threshold bits. Faculty of the current add_records call
+        are looked up in seen_urls and seen_bands, the stored faculty in faculty_fingerprint.
+        Private method. Not accessible outside the class.
+        :return: tuple of the faculty_homepage_url of the duplicated faculty and True if it is a near duplicate,
+                 or (None, False)
+        """
+        canonical_url, signed_simhash, bands = fingerprint[0], fingerprint[1], fingerprint[2:]
+
+        if canonical_url in seen_urls:
+            return seen_urls[canonical_url], False
+
+        row = conn.execute("""
+        SELECT  f.faculty_homepage_url
+          FROM  faculty_fingerprint p
+          JOIN  faculty_info f ON f.id = p.faculty_id
+         WHERE  p.canonical_url = ?
+      ORDER BY  f.id
+         LIMIT  1""", (canonical_url,)).fetchone()
+        if row:
+            return row[0], False
+
+        if signed_simhash is None:
+            return None, False
+
+        fingerprint = from_signed64(signed_simhash)
+        candidates = [candidate for i, band in enumerate(bands) for candidate in seen_bands.get((i, band), [])]
+        candidates += conn.execute("""
+        SELECT  p.simhash, f.faculty_homepage_url
+          FROM  faculty_fingerprint p
+          JOIN  faculty_info f ON f.id = p.faculty_id
+         WHERE  p.band0 = ? OR p.band1 = ? OR p.band2 = ? OR p.band3 = ?""", bands).fetchall()
+
+        for candidate_simhash, url in candidates:
+            if hamming_distance(fingerprint, from_signed64(candidate_simhash)) <= self.dedup_simhash_threshold:
+                return url, True
+
+        return None, False
+
+    def __current_snapshot(self):
+        """
+        Get the path of the latest snapshot named by the CURRENT pointer file of the snapshot directory.
+        Private method. Not accessible outside the class.
+        :return: snapshot file path or None if no snapshot was created
+        """
         try:
-            c = conn.cursor()
-            c.execute(create_faculty_info_table_sql)
+            with open(os.path.join(self.snapshot_dir, "CURRENT")) as f:
+                name = f.read().strip()
+
+        except FileNotFoundError:
+            return None
+
+        return os.path.join(self.snapshot_dir, name) if name else None
+
+    def __open_snapshot_connection(self, connections: dict):
+        """
+        Get the read-only connection of the current thread to the latest snapshot. The connection is reopened when
+        create_snapshot points CURRENT to a newer snapshot. Falls back to the database if there is no snapshot.
+        Private method. Not accessible outside the class.
+        :return: sqlite3 connection
+        """
+        snapshot_file = self.__current_snapshot()
+        if snapshot_file is None:
+            return self.__open_connection()
+
+        key = ("snapshot", self.snapshot_dir)
+        if key in connections:
+            opened_file, conn = connections[key]
+            if opened_file == snapshot_file:
+                return conn
+
+            # switch to the new snapshot
+            del connections[key]
+            conn.close()
+
+        # immutable: the snapshot never changes, so SQLite3 reads it without any locking or change detection
+        try:
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(snapshot_file))}?mode=ro&immutable=1",
+                                   uri=True)
+            for pragma in ("cache_size", "mmap_size"):
+                if pragma in self.pragmas:
+                    conn.execute(f"PRAGMA {pragma} = {self.pragmas[pragma]}")
+
+            conn.create_function("faculty_decompress", 2, lambda codec, data: decompress_text(data, codec),
+                                 deterministic=True)
 
         except Error as e:
-            raise Exception("Unexpected SQLite3 table creation error: " + str(e))
+            raise Exception("Unexpected SQLite3 snapshot connection error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 table creation error: " + str(e))
+        connections[key] = (snapshot_file, conn)
+        return conn
+
+    def __open_connection(self, snapshot: bool = False):
+        """
+        Get the SQLite3 connection of the current thread, opening it on first use. Also creates tables if not present.
+        Connections are opened in WAL mode, so readers of the web server threads do not block the crawler writes.
+        A forked worker (gunicorn) opens its own connections instead of using the ones of the parent process.
+        Private method. Not accessible outside the class.
+        :param snapshot: get the read-only connection to the latest snapshot instead
+        :return: sqlite3 connection
+        """
+        connections = getattr(_local, "connections", None)
+        if connections is None or _local.pid != os.getpid():
+            connections = _local.connections = {}
+            _local.pid = os.getpid()
+
+        if snapshot:
+            return self.__open_snapshot_connection(connections)
+
+        conn = connections.get(self.db_file)
+        if conn is not None:
+            return conn
+
+        # create database and open a conection
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+
+            pragmas = {"journal_mode": "WAL", "synchronous": "NORMAL", "temp_store": "MEMORY",
+                       "cache_size": -16000, "mmap_size": 268435456, "busy_timeout": 30000}
+            pragmas.update(self.pragmas)
+            for pragma, value in pragmas.items():
+                conn.execute(f"PRAGMA {pragma} = {value}")
+
+            # used by the full text index to read the compressed biodata
+            conn.create_function("faculty_decompress", 2, lambda codec, data: decompress_text(data, codec),
+                                 deterministic=True)
+
+        except Error as e:
+            raise Exception("Unexpected SQLite3 database connection error: " + str(e))
+
+        self.__create_tables(conn)
+        connections[self.db_file] = conn
 
         return conn
 
     def __close_connection(self, conn):
         """
-        Closes the opened connection.
+        Releases the connection of the current thread. The connection stays open for the next call;
+        an uncommitted transaction is rolled back.
         Private method. Not accessible outside the class.
 
         :param conn:
@@ -81,20 +722,27 @@ class FacultyDB:
         """
         try:
             if conn:
-                conn.close()
+                if conn.in_transaction:
+                    conn.rollback()
+
         except Error as e:
-            try:
-                if conn:
-                    conn.close()
-            except Error as e:
-                raise Exception("Unexpected SQLite3 connection close  error: " + str(e))
+            raise Exception("Unexpected SQLite3 connection close  error: " + str(e))
 
-            except Exception as e:
-                raise Exception("Unexpected SQLite3 connection close  error: " + str(e))
+    def __content_hash(self, faculty: dict):
+        """
+        Hash of the crawled content of a faculty record, used to skip rewriting unchanged rows.
+        Private method. Not accessible outside the class.
+        """
+        content = [faculty.get(column) for column in self.faculty_columns if column != "id"]
+        return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
 
-    def add_records(self, faculty_data: list):
+    def add_records(self, faculty_data: list, batch_size: int = 500, verbose: bool = False):
         """
-        Add records in databse tables.
+        Add records in databse tables. A faculty already present (same faculty_homepage_url) is updated
+        with the crawled data, only if its content changed.
+        Duplicates are resolved before anything is written: a record whose url canonicalizes to the url of a known
+        faculty (http/https, trailing or repeated slashes, ...) is merged into that faculty, a record whose biodata
+        is a near duplicate (SimHash) of a known faculty under another url is skipped.
         :param data: list of dictionaries. Each disctionary in below format:
                      [{"faculty_name": <>,
                        "faculty_homepage_url": <>,
@@ -109,285 +757,756 @@ class FacultyDB:
                        "faculty_biodata": <>,
                       }, {...}
                      ]
+        :param batch_size: number of records written per transaction
+        :param verbose: print every record
         """
-        # print("faculty_data: ", faculty_data)
-
         if not faculty_data:
             return
 
-        faculty_records = []
+        print(f"{len(faculty_data)} record(s) ready for upsert into faculty_info table.\n")
+
+        # insert new faculty, update a known faculty (same faculty_homepage_url) only if its content changed
+        upsert_faculty_sql = """
+        INSERT INTO faculty_info (faculty_name,
+                                  faculty_homepage_url,
+                                  faculty_department_url,
+                                  faculty_department_name,
+                                  faculty_university_url,
+                                  faculty_university_name,
+                                  faculty_email,
+                                  faculty_phone,
+                                  faculty_location,
+                                  faculty_expertise,
+                                  content_hash,
+                                  last_modified_at,
+                                  created_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT (faculty_homepage_url) DO UPDATE
+           SET  faculty_name = excluded.faculty_name,
+                faculty_department_url = excluded.faculty_department_url,
+                faculty_department_name = excluded.faculty_department_name,
+                faculty_university_url = excluded.faculty_university_url,
+                faculty_university_name = excluded.faculty_university_name,
+                faculty_email = excluded.faculty_email,
+                faculty_phone = excluded.faculty_phone,
+                faculty_location = excluded.faculty_location,
+                faculty_expertise = excluded.faculty_expertise,
+                content_hash = excluded.content_hash,
+                last_modified_at = excluded.last_modified_at
+         WHERE  faculty_info.content_hash IS NOT excluded.content_hash
+        """
 
-        print(f"{len(faculty_data)} record(s) ready for insert into faculty_info table.\n")
+        # biodata is stored compressed in faculty_biodata, keyed by the id of the upserted faculty_info row
+        upsert_biodata_sql = """
+        INSERT INTO faculty_biodata (faculty_id, codec, biodata)
+        SELECT  id, ?, ?
+          FROM  faculty_info
+         WHERE  faculty_homepage_url = ?
+        ON CONFLICT (faculty_id) DO UPDATE
+           SET  codec = excluded.codec,
+                biodata = excluded.biodata
+        """
 
-        n = len(faculty_data)
-        # Form bulk records for faculty_info insert opertation
-        for i, faculty in enumerate(faculty_data):
-            record = [None]
-            record.append(faculty["faculty_name"])
-            record.append(faculty["faculty_homepage_url"])
-            record.append(faculty["faculty_department_url"])
-            record.append(faculty["faculty_department_name"])
-            record.append(faculty["faculty_university_url"])
-            record.append(faculty["faculty_university_name"])
-            record.append(faculty["faculty_email"])
-            record.append(faculty["faculty_phone"])
-            record.append(faculty["faculty_location"])
-            record.append(faculty["faculty_expertise"])
-            record.append(faculty["faculty_biodata"])
-            record.extend([datetime.now(), datetime.now()])
-            faculty_records.append(tuple(record))
-
-            print(f"{'*' * 50}")
-            print (f"DB Record: {i + 1} / {n}")
-            print ("DB:: faculty_name", faculty["faculty_name"])
-            print ("DB:: faculty_homepage_url", faculty["faculty_homepage_url"])
-            print ("DB:: faculty_department_url", faculty["faculty_department_url"])
-            print ("DB:: faculty_department_name", faculty["faculty_department_name"])
-            print ("DB:: faculty_university_url", faculty["faculty_university_url"])
-            print ("DB:: faculty_university_name", faculty["faculty_university_name"])
-            print ("DB:: faculty_email", faculty["faculty_email"])
-            print ("DB:: faculty_phone", faculty["faculty_phone"])
-            print ("DB:: faculty_location", faculty["faculty_location"])
-            print ("DB:: faculty_expertise", faculty["faculty_expertise"])
-            print ("DB:: faculty_biodata length", len(faculty["faculty_biodata"]))
-            print(f"{'*' * 50}")
+        # canonical url and SimHash of the upserted faculty
+        upsert_fingerprint_sql = """
+        INSERT INTO faculty_fingerprint (faculty_id, canonical_url, simhash, band0, band1, band2, band3)
+        SELECT  id, ?, ?, ?, ?, ?, ?
+          FROM  faculty_info
+         WHERE  faculty_homepage_url = ?
+        ON CONFLICT (faculty_id) DO UPDATE
+           SET  canonical_url = excluded.canonical_url,
+                simhash = excluded.simhash,
+                band0 = excluded.band0,
+                band1 = excluded.band1,
+                band2 = excluded.band2,
+                band3 = excluded.band3
+        """
 
+        n = len(faculty_data)
+        changed = merged = skipped = 0
+        seen_urls, seen_bands = {}, {}
         try:
             conn = self.__open_connection()
             c = conn.cursor()
 
-            # print ("faculty_records: ", faculty_records)
-
-            # insert bulk records ignoring duplicates (silently ignore if faculty_homepage_url already exists)
-            c.executemany('INSERT  OR IGNORE INTO faculty_info VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?);', faculty_records)
-            conn.commit()
-            print(f"{c.rowcount} record(s) inserted into faculty_info table. "
-                  f"{'(DUPLICATE ROWS FOUND)' if len(faculty_data) != c.rowcount else ''} \n")
+            for start in range(0, n, batch_size):
+                batch = []
+                faculty_records, biodata_records, fingerprint_records = [], [], []
+
+                # resolve the duplicates of known faculty and of the records added before in this call
+                for faculty in faculty_data[start:start + batch_size]:
+                    fingerprint = self.__fingerprint(faculty["faculty_homepage_url"], faculty["faculty_biodata"])
+                    url, near_duplicate = self.__find_duplicate(conn, fingerprint, seen_urls, seen_bands)
+                    if near_duplicate:
+                        skipped += 1
+                        continue
+
+                    if url and url != faculty["faculty_homepage_url"]:
+                        faculty = dict(faculty, faculty_homepage_url=url)
+                        merged += 1
+
+                    url = faculty["faculty_homepage_url"]
+                    seen_urls[fingerprint[0]] = url
+                    if fingerprint[1] is not None:
+                        for i, band in enumerate(fingerprint[2:]):
+                            seen_bands.setdefault((i, band), []).append((fingerprint[1], url))
+                    batch.append((faculty, fingerprint))
+
+                # content hashes of the known faculty, so that the biodata of unchanged faculty is not recompressed
+                urls = [faculty["faculty_homepage_url"] for faculty, _ in batch]
+                known_hashes = dict(c.execute("SELECT faculty_homepage_url, content_hash FROM faculty_info "
+                                              "WHERE faculty_homepage_url IN (" + ",".join("?" * len(urls)) + ")",
+                                              urls).fetchall())
+
+                # Form bulk records for faculty_info and faculty_biodata upsert opertations
+                for i, (faculty, fingerprint) in enumerate(batch, start=start):
+                    content_hash = self.__content_hash(faculty)
+                    if known_hashes.get(faculty["faculty_homepage_url"]) == content_hash:
+                        continue
+
+                    now = int(datetime.now().timestamp() * 1000)
+                    faculty_records.append((faculty["faculty_name"],
+                                            faculty["faculty_homepage_url"],
+                                            faculty["faculty_department_url"],
+                                            faculty["faculty_department_name"],
+                                            faculty["faculty_university_url"],
+                                            faculty["faculty_university_name"],
+                                            faculty["faculty_email"],
+                                            faculty["faculty_phone"],
+                                            faculty["faculty_location"],
+                                            faculty["faculty_expertise"],
+                                            content_hash,
+                                            now,
+                                            now))
+                    biodata_records.append(compress_text(faculty["faculty_biodata"], self.biodata_codec)
+                                           + (faculty["faculty_homepage_url"],))
+                    fingerprint_records.append(fingerprint + (faculty["faculty_homepage_url"],))
+
+                    if verbose:
+                        print(f"{'*' * 50}")
+                        print (f"DB Record: {i + 1} / {n}")
+                        for column in self.faculty_columns[1:-1]:
+                            print (f"DB:: {column}", faculty[column])
+                        print ("DB:: faculty_biodata length", len(faculty["faculty_biodata"]))
+                        print(f"{'*' * 50}")
+
+                if not faculty_records:
+                    continue
+
+                # one transaction per batch
+                c.executemany(upsert_faculty_sql, faculty_records)
+                changed += c.rowcount
+                c.executemany(upsert_biodata_sql, biodata_records)
+                c.executemany(upsert_fingerprint_sql, fingerprint_records)
+                conn.commit()
+
+            print(f"{merged} record(s) merged into the faculty of the same canonical url. "
+                  f"{skipped} near duplicate record(s) skipped.")
+            print(f"{changed} record(s) inserted or updated in faculty_info table. "
+                  f"{n - skipped - changed} record(s) unchanged.\n")
 
             # close the connection
             self.__close_connection(conn)
 
         except Error as e:
-            raise Exception("Unexpected SQLite3 connection close  error: " + str(e))
+            self.__close_connection(conn)
+            raise Exception("Unexpected SQLite3 upsert error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 connection close  error: " + str(e))
+        # the facet values of this process are read again on next use
+        if changed:
+            with _facet_lock:
+                _facet_cache.clear()
+
+        # publish the changes to the readers of the snapshots
+        if self.snapshot_after_add and changed:
+            self.create_snapshot()
+
+        # make the changes searchable by the prebuilt BM25 index, if any. They stay in the change log on failure.
+        if self.ranker_update_after_add and changed:
+            from apps.backend.utils.ranker import Ranker
+            try:
+                Ranker.update()
+
+            except Exception as e:
+                print(f"Unexpected exception encountered while updating the BM25 index: {e}")
+
+        # Now push the changes to the elastic search index. The full text index is kept in sync by triggers.
+        if not changed or get_config("search").get("backend", "elasticsearch") != "elasticsearch":
+            return
 
-        # Now reindex the elastic search
         try:
-            ElasticSearchAPI().add_records(self.get_faculty_records())
+            self.sync_search_index()
 
         except Exception as e:
             raise Exception("Unexpected expectation occured while reindex ElasticSearch: " + repr(e))
 
-    def get_biodata_records(self, university_filter=None, department_filter=None, location_filter=None):
+    def create_snapshot(self, keep: int = None):
         """
-        Get faculty biodata. if ay of the filter parameters are provided, get biodate based on filters
-        :param university_filter:
-        :param location_filter:
-        :return:
+        Copies the database to a new read-only snapshot with the SQLite3 backup API, then points the CURRENT file of
+        the snapshot directory to it. Readers (FacultyDB(snapshot=True)) switch to the new snapshot on their next
+        query. The backup reads a consistent state of the database without blocking the crawler writes.
+        :param keep: number of snapshots kept. Older ones are deleted. Defaults to database.snapshots.keep.
+        :return: path of the new snapshot
         """
+        keep = keep if keep else self.snapshot_keep
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        name = os.path.splitext(os.path.basename(self.db_file))[0] + f"-{datetime.now():%Y%m%d%H%M%S%f}.db"
+        snapshot_file = os.path.join(self.snapshot_dir, name)
+
         try:
             conn = self.__open_connection()
-            c = conn.cursor()
+            snapshot_conn = sqlite3.connect(snapshot_file + ".tmp")
+            try:
+                conn.backup(snapshot_conn)
 
-            select_biodata_sql = 'SELECT id, faculty_biodata FROM faculty_info'
-            if university_filter:
-                select_biodata_sql += " WHERE faculty_university_name LIKE '%" + university_filter + "%'"
-                if department_filter:
-                    select_biodata_sql += " OR faculty_department_name LIKE '%" + department_filter + "%'"
-                    if location_filter:
-                        select_biodata_sql += " OR faculty_location LIKE '%" + location_filter + "%'"
+                # a snapshot opened with immutable=1 must not be in WAL mode
+                snapshot_conn.execute("PRAGMA journal_mode = DELETE")
 
-            elif department_filter:
-                select_biodata_sql += " WHERE faculty_department_name LIKE '%" + department_filter + "%'"
-                if location_filter:
-                    select_biodata_sql += " OR faculty_location LIKE '%" + location_filter + "%'"
+            finally:
+                snapshot_conn.close()
 
-            elif location_filter:
-                select_biodata_sql += " WHERE faculty_location LIKE '%" + location_filter + "%'"
+            self.__close_connection(conn)
 
-            else:
+        except Error as e:
+            raise Exception("Unexpected SQLite3 backup error: " + str(e))
+
+        # publish the snapshot: both renames are atomic, so readers never see a partial snapshot
+        os.replace(snapshot_file + ".tmp", snapshot_file)
+        with open(os.path.join(self.snapshot_dir, "CURRENT.tmp"), "w") as f:
+            f.write(name)
+        os.replace(os.path.join(self.snapshot_dir, "CURRENT.tmp"), os.path.join(self.snapshot_dir, "CURRENT"))
+
+        print(f"Snapshot {name} created.")
+
+        # readers still using a deleted snapshot keep reading it until they switch
+        prefix = os.path.splitext(os.path.basename(self.db_file))[0] + "-"
+        snapshots = sorted(f for f in os.listdir(self.snapshot_dir) if f.startswith(prefix) and f.endswith(".db"))
+        for old_name in snapshots[:-keep]:
+            try:
+                os.remove(os.path.join(self.snapshot_dir, old_name))
+            except OSError:
                 pass
 
-            # print("select_biodata_sql: ", select_biodata_sql)
+        return snapshot_file
 
-            c.execute(select_biodata_sql)
-            records = c.fetchall()
+    def sync_search_index(self, full: bool = False, batch_size: int = 500):
+        """
+        Pushes faculty_info changes logged since the last sync to the elastic search index.
+        Only the changed rows are upserted and the deleted rows are removed from the index.
+        The whole table is reindexed if full is set, if the index does not exist yet or if changes since the last
+        sync were pruned from the change log.
+        :param full: rebuild the whole index
+        :param batch_size: number of changed rows read per round trip
+        :return: dictionary with the indexed and failed counts along with the reports of the failed chunks
+        """
+        elasticsearchapi = ElasticSearchAPI()
+        faculty_db = self if not self.snapshot else FacultyDB(snapshot=False)
+        changes, max_change_id = self.get_changes("elasticsearch")
+        current_index = elasticsearchapi.get_current_index()
 
-            records = [str(id) + " " + biodata for id, biodata in records] if records else []
+        if not full and changes == [] and current_index:
+            # nothing new: the index version, and the caches keyed on it, are kept
+            print("No faculty record changed since the last sync")
+            return {"indexed": 0, "failed": 0, "failed_chunks": []}
 
-            # print("Records: ", "\n".join(records))
+        if full or changes is None or not current_index:
+            print("Full reindex of faculty records")
+            summary = elasticsearchapi.add_records(faculty_db.iter_faculty_records(batch_size))
+
+        else:
+            upserted_ids = [faculty_id for faculty_id, operation in changes if operation == 'upsert']
+            deleted_ids = [faculty_id for faculty_id, operation in changes if operation == 'delete']
+            print(f"Syncing {len(upserted_ids)} changed and {len(deleted_ids)} deleted record(s) to the index")
+
+            changed_records = (record
+                               for i in range(0, len(upserted_ids), batch_size)
+                               for record in faculty_db.get_faculty_records(upserted_ids[i:i + batch_size]))
+            summary = elasticsearchapi.sync_records(changed_records, deleted_ids)
+
+        if summary["failed"] or summary.get("error"):
+            # keep the watermark so that the failed changes are retried by the next sync
+            return summary
+
+        self.set_sync_state("elasticsearch", max_change_id)
+
+        return summary
+
+    def get_changes(self, name: str, last_change_id: int = None):
+        """
+        Get the faculty_info changes logged since the last sync of a search index, see set_sync_state.
+        :param name: search index name
+        :param last_change_id: change id to read from instead of the one of the last sync
+        :return: tuple of the list of (faculty id, operation) of the latest operation ('upsert' or 'delete') of every
+                 changed row, or None if changes were pruned from the log before they were read, and the change id
+                 to pass to set_sync_state once they are applied
+        """
+        try:
+            conn = self.__open_connection()
+
+            if last_change_id is None:
+                last_change_id = conn.execute("SELECT last_change_id FROM search_sync_state WHERE name = ?",
+                                              (name,)).fetchone()
+                last_change_id = last_change_id[0] if last_change_id else 0
+            max_change_id = conn.execute("SELECT COALESCE(MAX(change_id), 0) FROM faculty_change_log").fetchone()[0]
+
+            # change ids are consecutive, so a gap after the last change read means pruned changes
+            first_change_id = conn.execute("SELECT MIN(change_id) FROM faculty_change_log WHERE change_id > ?",
+                                           (last_change_id,)).fetchone()[0]
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'faculty_change_log'").fetchone()
+            if sequence and sequence[0] > last_change_id and (first_change_id or 0) != last_change_id + 1:
+                self.__close_connection(conn)
+                return None, max(max_change_id, sequence[0])
+
+            # latest operation of every row changed since the last sync
+            changes = conn.execute("""
+            SELECT  faculty_id, operation
+              FROM  faculty_change_log
+             WHERE  change_id IN (SELECT  MAX(change_id)
+                                    FROM  faculty_change_log
+                                   WHERE  change_id > ? AND change_id <= ?
+                                GROUP BY  faculty_id)
+            """, (last_change_id, max_change_id)).fetchall()
 
-            # close the connection
             self.__close_connection(conn)
 
         except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 error: " + str(e))
+        return changes, max(max_change_id, last_change_id)
 
-        return records
-
-    def get_faculty_records(self, id: list = None):
+    def set_sync_state(self, name: str, last_change_id: int):
         """
-        Get faculty biodata. if ay of the filter parameters are provided, get biodate based on filters
-        :param university_filter:
-        :param location_filter:
-        :return:
+        Records that a search index applied the faculty_info changes up to a change id. The changes applied by all
+        the search indexes are deleted from the change log.
+        :param name: search index name, e.g. "elasticsearch" or "bm25"
+        :param last_change_id: change id returned by get_changes
         """
         try:
             conn = self.__open_connection()
-            conn.row_factory = sqlite3.Row
+            conn.execute("INSERT OR REPLACE INTO search_sync_state (name, last_change_id, synced_at) VALUES (?, ?, ?)",
+                         (name, last_change_id, int(datetime.now().timestamp() * 1000)))
+            conn.execute("DELETE FROM faculty_change_log "
+                         "WHERE change_id <= (SELECT MIN(last_change_id) FROM search_sync_state)")
+            conn.commit()
+            self.__close_connection(conn)
 
+        except Error as e:
+            raise Exception("Unexpected SQLite3 error: " + str(e))
 
-            if id:
-                ids = "('" + "','".join([str(i) for i in id]) + "')"
-                select_faculty_sql = """
-                SELECT  id,
-                        faculty_name,
-                        faculty_homepage_url,
-                        faculty_department_url,
-                        faculty_department_name,
-                        faculty_university_url,
-                        faculty_university_name,
-                        faculty_email,
-                        faculty_phone,
-                        faculty_location,
-                        faculty_expertise,
-                        faculty_biodata
-                  FROM  faculty_info
-                  WHERE id IN """ + ids
+    def __filter_sql(self, university_filter=None, department_filter=None, location_filter=None,
+                     match: str = "exact"):
+        """
+        Builds the parameterized WHERE predicates for the selected filters. Values of a filter are ORed,
+        filters are ANDed. Matching is case insensitive and served by the NOCASE indexes of the filter columns:
+        exact values with an IN list, prefixes with a range.
+        Private method. Not accessible outside the class.
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param match: "exact" or "prefix"
+        :return: tuple of list of predicates and list of parameters
+        """
+        predicates, params = [], []
+        for column, values in (("faculty_university_name", university_filter),
+                               ("faculty_department_name", department_filter),
+                               ("faculty_location", location_filter)):
+            values = [values] if isinstance(values, str) else values
+            values = [value.strip() for value in values or [] if value and value.strip()]
+            if not values:
+                continue
+
+            if match == "prefix":
+                ranges = []
+                for value in values:
+                    # every string starting with the value sorts between the value and its successor. NOCASE
+                    # compares ASCII letters lowercased, so the bounds are folded the same way
+                    value = value.translate(_NOCASE_FOLD)
+                    successor = chr(ord(value[-1]) + 1)
+                    if "A" <= successor <= "Z":
+                        # "@" is followed by the folded away "A".."Z", its successor in NOCASE order is "["
+                        successor = "["
+                    ranges.append(f"(f.{column} COLLATE NOCASE >= ? AND f.{column} COLLATE NOCASE < ?)")
+                    params.extend([value, value[:-1] + successor])
+                predicates.append("(" + " OR ".join(ranges) + ")")
 
             else:
-                select_faculty_sql = """
-                SELECT  id,
-                        faculty_name,
-                        faculty_homepage_url,
-                        faculty_department_url,
-                        faculty_department_name,
-                        faculty_university_url,
-                        faculty_university_name,
-                        faculty_email,
-                        faculty_phone,
-                        faculty_location,
-                        faculty_expertise,
-                        faculty_biodata
-                  FROM  faculty_info
-                """
-
-            # print("select_faculty_sql: ", select_faculty_sql)
-
-            records = conn.execute(select_faculty_sql)
-            records = [{k: item[k] for k in item.keys()} for item in records]
+                predicates.append(f"f.{column} COLLATE NOCASE IN ({','.join('?' * len(values))})")
+                params.extend(values)
 
-            # print("Records: ", records)
+        return predicates, params
+
+    def __fts_query(self, query: str):
+        """
+        Converts free text to a FTS5 query matching any of its terms. Terms are quoted so that
+        FTS5 operators and punctuation typed by the user are not interpreted.
+        Private method. Not accessible outside the class.
+        """
+        terms = re.findall(r"\w+", query or "")
+        return " OR ".join(f'"{term}"' for term in terms)
+
+    def search_fts(self, query: str, n: int = 10, offset: int = 0, university_filter=None, department_filter=None,
+                   location_filter=None, weights: list = None):
+        """
+        Ranks faculty for the query with the bm25() function of the faculty_fts full text index.
+        :param query: search query string
+        :param n: number of results to return
+        :param offset: number of ranked results to skip
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param weights: bm25 column weights for name, biodata, expertise, department, university and location
+        :return: list of faculty dictionaries without the biodata
+        """
+        fts_query = self.__fts_query(query)
+        if not fts_query:
+            return []
+
+        weights = weights if weights else [10.0, 1.0, 5.0, 2.0, 2.0, 2.0]
+        predicates, params = self.__filter_sql(university_filter, department_filter, location_filter)
+
+        select_faculty_sql = f"""
+        SELECT  f.id,
+                f.faculty_name,
+                f.faculty_homepage_url,
+                f.faculty_department_url,
+                f.faculty_department_name,
+                f.faculty_university_url,
+                f.faculty_university_name,
+                f.faculty_email,
+                f.faculty_phone,
+                f.faculty_location,
+                f.faculty_expertise
+          FROM  faculty_fts
+          JOIN  faculty_info f ON f.id = faculty_fts.rowid
+         WHERE  faculty_fts MATCH ? {''.join(' AND ' + predicate for predicate in predicates)}
+      ORDER BY  bm25(faculty_fts, {', '.join(str(float(weight)) for weight in weights)})
+         LIMIT  ? OFFSET ?
+        """
+
+        try:
+            conn = self.__open_connection(self.snapshot)
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+
+            records = c.execute(select_faculty_sql, [fts_query] + params + [n, offset])
+            records = [{k: item[k] for k in item.keys()} for item in records]
 
-            # close the connection
             self.__close_connection(conn)
 
         except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 error: " + str(e))
-
         return records
 
-    def get_all_universities(self):
+    def get_fts_facets(self, query: str = None, university_filter=None, department_filter=None, location_filter=None):
         """
-        Get list of all universities
-        :return: list of strings with universities name
+        Get the university, department and location counts of the faculty matching the query and filters,
+        or of all faculty if no query is given.
+        :return: dictionary of facet name -> list of {"value": <>, "count": <>} ordered by descending count
         """
+        fts_query = self.__fts_query(query)
+        predicates, params = self.__filter_sql(university_filter, department_filter, location_filter)
+        if not fts_query and not predicates:
+            return self.get_facet_values()
+
+        if fts_query:
+            predicates.insert(0, "faculty_fts MATCH ?")
+            params.insert(0, fts_query)
+
+        source_sql = "faculty_fts JOIN faculty_info f ON f.id = faculty_fts.rowid" if fts_query else "faculty_info f"
+        where_sql = "WHERE " + " AND ".join(predicates) if predicates else ""
+
+        facets = {}
         try:
-            conn = self.__open_connection()
+            conn = self.__open_connection(self.snapshot)
+
+            for name, column in (("university", "faculty_university_name"),
+                                 ("department", "faculty_department_name"),
+                                 ("location", "faculty_location")):
+                records = conn.execute(f"""
+                SELECT  f.{column}, COUNT(*)
+                  FROM  {source_sql}
+                  {where_sql}
+              GROUP BY  f.{column}
+              ORDER BY  COUNT(*) DESC
+                """, params)
+                facets[name] = [{"value": value, "count": count} for value, count in records]
 
-            select_faculty_sql = """
-            SELECT  DISTINCT faculty_university_name
-              FROM  faculty_info
-            """
+            self.__close_connection(conn)
+
+        except Error as e:
+            raise Exception("Unexpected SQLite3 error: " + str(e))
 
-            # print("select_faculty_sql: ", select_faculty_sql)
+        return facets
 
-            records = conn.execute(select_faculty_sql)
-            records = [record[0] for record in records]
+    def get_facet_values(self):
+        """
+        Get the university, department and location values of all faculty with their faculty counts.
+        Served from memory. The counts are read from the faculty_facet_counts summary table again after add_records
+        commits in this process, or when another process changed the data (checked every facet_check_interval
+        seconds).
+        :return: dictionary of facet name -> list of {"value": <>, "count": <>} ordered by descending count
+        """
+        key = (self.db_file, self.snapshot)
+        with _facet_lock:
+            cached = _facet_cache.get(key)
+            if cached and time.monotonic() - cached["checked_at"] < self.facet_check_interval:
+                return cached["facets"]
+
+        version = (self.__current_snapshot() if self.snapshot else None, self.get_data_version())
+        with _facet_lock:
+            cached = _facet_cache.get(key)
+            if cached and cached["version"] == version:
+                cached["checked_at"] = time.monotonic()
+                return cached["facets"]
+
+        facets = {"university": [], "department": [], "location": []}
+        try:
+            conn = self.__open_connection(self.snapshot)
 
-            # print("Records: ", records)
+            records = conn.execute("SELECT facet, value, count FROM faculty_facet_counts "
+                                   "ORDER BY count DESC, value")
+            for facet, value, count in records:
+                facets[facet].append({"value": value, "count": count})
 
-            # close the connection
             self.__close_connection(conn)
 
         except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 error: " + str(e))
+        with _facet_lock:
+            _facet_cache[key] = {"version": version, "checked_at": time.monotonic(), "facets": facets}
 
-        return records
+        return facets
 
-    def get_all_departments(self):
+    def get_data_version(self):
         """
-        Get list of all departments
-        :return: list of strings with departments name
+        Get a number that grows with every insert, update or delete of faculty_info.
+        :return: integer version
         """
         try:
-            conn = self.__open_connection()
+            conn = self.__open_connection(self.snapshot)
+            version = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'faculty_change_log'").fetchone()
+            self.__close_connection(conn)
 
-            select_faculty_sql = """
-            SELECT  DISTINCT faculty_department_name
-              FROM  faculty_info
-            """
+        except Error as e:
+            raise Exception("Unexpected SQLite3 error: " + str(e))
 
-            # print("select_faculty_sql: ", select_faculty_sql)
+        return version[0] if version else 0
 
-            records = conn.execute(select_faculty_sql)
-            records = [record[0] for record in records]
+    def iter_biodata_records(self, university_filter=None, department_filter=None, location_filter=None,
+                             match: str = "prefix", batch_size: int = 500):
+        """
+        Streams faculty biodata. if any of the filter parameters are provided, streams biodata of the faculty
+        matching all of the filters. Filters are resolved on the indexes of the filter columns before any biodata
+        is read. Rows are fetched batch_size rows at a time.
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param match: "exact" or "prefix" (case insensitive) match of the filter values
+        :param batch_size: number of rows fetched per round trip
+        :return: generator of strings in "<id> <biodata>" format
+        """
+        predicates, params = self.__filter_sql(university_filter, department_filter, location_filter, match)
+        select_biodata_sql = ('SELECT f.id, b.codec, b.biodata FROM faculty_info f '
+                              'JOIN faculty_biodata b ON b.faculty_id = f.id')
+        if predicates:
+            select_biodata_sql += " WHERE " + " AND ".join(predicates)
 
-            # print("Records: ", records)
+        conn = None
+        try:
+            conn = self.__open_connection(self.snapshot)
+            c = conn.cursor()
 
-            # close the connection
-            self.__close_connection(conn)
+            c.execute(select_biodata_sql, params)
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                for id, codec, biodata in rows:
+                    yield str(id) + " " + decompress_text(biodata, codec)
 
         except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
-        except Exception as e:
+        finally:
+            # close the connection
+            self.__close_connection(conn)
+
+    def get_faculty_ids(self, university_filter=None, department_filter=None, location_filter=None,
+                        match: str = "prefix"):
+        """
+        Get the ids of the faculty matching all of the filters, resolved on the indexes of the filter columns.
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param match: "exact" or "prefix" (case insensitive) match of the filter values
+        :return: list of faculty ids
+        """
+        predicates, params = self.__filter_sql(university_filter, department_filter, location_filter, match)
+        select_ids_sql = 'SELECT f.id FROM faculty_info f'
+        if predicates:
+            select_ids_sql += " WHERE " + " AND ".join(predicates)
+
+        try:
+            conn = self.__open_connection(self.snapshot)
+            records = [record[0] for record in conn.execute(select_ids_sql, params)]
+            self.__close_connection(conn)
+
+        except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
         return records
 
-    def get_all_locations(self):
+    def get_biodata_records(self, university_filter=None, department_filter=None, location_filter=None,
+                            match: str = "prefix"):
         """
-        Get list of all locations
-        :return: list of strings with locations name
+        Get faculty biodata. if any of the filter parameters are provided, get biodata of the faculty matching
+        all of the filters. See iter_biodata_records to stream them instead.
+        :param university_filter: university name or list of university names
+        :param department_filter: department name or list of department names
+        :param location_filter: location or list of locations
+        :param match: "exact" or "prefix" (case insensitive) match of the filter values
+        :return: list of strings in "<id> <biodata>" format
+        """
+        return list(self.iter_biodata_records(university_filter, department_filter, location_filter, match))
+
+    def get_last_sync_time(self, name: str = "elasticsearch"):
+        """
+        Get the time of the last successful sync of a search index.
+        :param name: search index name
+        :return: datetime or None if the index was never synced
         """
         try:
-            conn = self.__open_connection()
+            conn = self.__open_connection(self.snapshot)
+            synced_at = conn.execute("SELECT synced_at FROM search_sync_state WHERE name = ?", (name,)).fetchone()
+            self.__close_connection(conn)
 
-            select_faculty_sql = """
-            SELECT  DISTINCT faculty_location
-              FROM  faculty_info
-            """
+        except Error as e:
+            raise Exception("Unexpected SQLite3 error: " + str(e))
+
+        return datetime.fromtimestamp(synced_at[0] / 1000) if synced_at and synced_at[0] else None
+
+    def get_changed_records(self, since: datetime, columns: list = None):
+        """
+        Get the faculty records inserted or updated since a time, e.g. get_last_sync_time(), oldest change first.
+        Served by the index of last_modified_at. See iter_faculty_records to stream them instead.
+        :param since: datetime
+        :param columns: faculty_info columns to return. Defaults to all the faculty columns.
+        :return: list of faculty record dictionaries
+        """
+        return list(self.iter_faculty_records(columns=columns, changed_since=since))
 
-            # print("select_faculty_sql: ", select_faculty_sql)
+    def get_faculty_records(self, id: list = None, columns: list = None):
+        """
+        Get faculty records. if ids are provided, get the records of those faculty only.
+        See iter_faculty_records to stream them instead.
+        :param id: list of faculty ids
+        :param columns: faculty_info columns to return. Defaults to all the faculty columns.
+        :return: list of faculty record dictionaries
+        """
+        return list(self.iter_faculty_records(id=id, columns=columns))
 
-            records = conn.execute(select_faculty_sql)
-            records = [record[0] for record in records]
+    def iter_faculty_records(self, batch_size: int = 500, columns: list = None, id: list = None,
+                             changed_since: datetime = None):
+        """
+        Streams faculty records. Rows are fetched from the cursor batch_size rows at a time,
+        so the whole table is never held in memory.
+        :param batch_size: number of rows fetched per round trip
+        :param columns: faculty_info columns to return. Defaults to all the faculty columns.
+                        Leaving out faculty_biodata avoids reading the biodata. created_at and last_modified_at
+                        (milliseconds since the epoch) can be requested as well.
+        :param id: list of faculty ids. Defaults to all faculty.
+        :param changed_since: only the faculty inserted or updated since this datetime, oldest change first
+        :return: generator of faculty record dictionaries
+        """
+        columns = columns if columns else self.faculty_columns
+        unknown_columns = set(columns) - set(self.faculty_columns) - {"created_at", "last_modified_at"}
+        if unknown_columns:
+            raise Exception("Unknown faculty columns: " + ", ".join(sorted(unknown_columns)))
+
+        # the compressed biodata is only read and decompressed if it is requested
+        select_columns = ["faculty_decompress(b.codec, b.biodata) AS faculty_biodata" if column == "faculty_biodata"
+                          else "f." + column for column in columns]
+        select_faculty_sql = """
+            SELECT  """ + """,
+                    """.join(select_columns) + """
+              FROM  faculty_info f"""
+        if "faculty_biodata" in columns:
+            select_faculty_sql += """
+         LEFT JOIN  faculty_biodata b ON b.faculty_id = f.id"""
+
+        conn = None
+        try:
+            conn = self.__open_connection(self.snapshot)
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
 
-            # print("Records: ", records)
+            if id:
+                # look up the ids in batches to stay below the SQLite3 host parameter limit
+                ids = [int(i) for i in id]
+                cursors = (c.execute(select_faculty_sql + " WHERE f.id IN (" + ",".join("?" * len(batch)) + ")", batch)
+                           for batch in (ids[i:i + batch_size] for i in range(0, len(ids), batch_size)))
+            elif changed_since:
+                cursors = [c.execute(select_faculty_sql + " WHERE f.last_modified_at >= ? ORDER BY f.last_modified_at",
+                                     (int(changed_since.timestamp() * 1000),))]
+            else:
+                cursors = [c.execute(select_faculty_sql)]
 
-            # close the connection
-            self.__close_connection(conn)
+            for cursor in cursors:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield {k: row[k] for k in row.keys()}
 
         except Error as e:
             raise Exception("Unexpected SQLite3 error: " + str(e))
 
-        except Exception as e:
-            raise Exception("Unexpected SQLite3 error: " + str(e))
+        finally:
+            # close the connection
+            self.__close_connection(conn)
 
-        return records
+    def export_records(self, file_path: str, columns: list = None, batch_size: int = 1000):
+        """
+        Exports faculty records to a JSON lines file, one record per line, in constant memory.
+        :param file_path: path of the export file
+        :param columns: faculty_info columns to export. Defaults to all the faculty columns.
+        :param batch_size: number of rows fetched per round trip
+        :return: number of exported records
+        """
+        count = 0
+        with open(file_path, "w", encoding="utf-8") as export_file:
+            for record in self.iter_faculty_records(batch_size, columns):
+                export_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+
+        print(f"{count} record(s) exported to {file_path}")
 
+        return count
+
+    def get_all_universities(self):
+        """
+        Get list of all universities
+        :return: list of strings with universities name
+        """
+        return [facet["value"] for facet in self.get_facet_values()["university"]]
+
+    def get_all_departments(self):
+        """
+        Get list of all departments
+        :return: list of strings with departments name
+        """
+        return [facet["value"] for facet in self.get_facet_values()["department"]]
+
+    def get_all_locations(self):
+        """
+        Get list of all locations
+        :return: list of strings with locations name
+        """
+        return [facet["value"] for facet in self.get_facet_values()["location"]]
 
 if __name__ == '__main__':
     from pprint import pprint
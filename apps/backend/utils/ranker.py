@@ -1,40 +1,477 @@
+import os
+import sys
+import json
+import time
+import shutil
 import logging
-from rank_bm25 import BM25Okapi
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
 
+import numpy as np
+
+from apps.backend.utils.bm25index import BM25Index, BM25Segments
 from apps.backend.utils.nltk_utils import sanitizer
+from apps.backend.utils.settings import get_config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Ranker over the prebuilt index, shared by the threads of the process
+_ranker = None
+_ranker_pid = None
+_ranker_version = None
+_ranker_checked_at = 0.0
+_ranker_lock = threading.Lock()
+
+# loaded segments by directory, reused when the index is reloaded with new segments
+_segments = {}
+
+# faculty_info columns stored sanitized by the crawler, see Document.extract_biodata
+SANITIZED_COLUMNS = {"faculty_biodata"}
+
+# updates and merges of the index by the threads of the process, see _index_lock
+_index_thread_lock = threading.Lock()
+
+
+def get_ranker():
+    """
+    Get the process wide Ranker over the index prebuilt by Ranker.build, loading it on first use.
+    If no index was built yet, it is built first from FacultyDB (unless ranker.build_if_missing is false).
+    The index arrays are memory mapped, so forked workers share their pages. The segments added by Ranker.update
+    and Ranker.merge are loaded when the segment list changes (checked every ranker.check_interval seconds).
+    :return: Ranker or None if no index was built
+    """
+    global _ranker, _ranker_pid, _ranker_version, _ranker_checked_at
+
+    config = get_config("ranker")
+    check_interval = config.get("check_interval", 1)
+    if _ranker_pid != os.getpid() or time.monotonic() - _ranker_checked_at >= check_interval:
+        with _ranker_lock:
+            if _ranker_pid != os.getpid() or time.monotonic() - _ranker_checked_at >= check_interval:
+                index_dir = Ranker.index_dir()
+                version = _index_version(index_dir)
+                if version is None and config.get("build_if_missing", True):
+                    try:
+                        Ranker.build(index_dir, if_missing=True)
+                        version = _index_version(index_dir)
+
+                    except Exception as e:
+                        print(f"Unexpected exception encountered while building the BM25 index: {e}")
+
+                if _ranker_pid != os.getpid() or (version is not None and version != _ranker_version):
+                    try:
+                        _ranker = Ranker.load(index_dir) if version is not None else None
+                        _ranker_version = version
+
+                    except Exception as e:
+                        # e.g. a segment removed by a merge after the segment list was read, retried on next check
+                        print(f"Unexpected exception encountered while loading the BM25 index: {e}")
+
+                _ranker_pid = os.getpid()
+                _ranker_checked_at = time.monotonic()
+
+    return _ranker
+
+
+def _index_version(index_dir: str):
+    """
+    Identity of the segment list of the index, changed by every build, update and merge.
+    :return: tuple or None if no index was built
+    """
+    for name in ("segments.json", "meta.json"):
+        try:
+            stat = os.stat(os.path.join(index_dir, name))
+            return name, stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            pass
+    return None
+
+
+@contextmanager
+def _index_lock(index_dir: str, blocking: bool = True):
+    """
+    Serializes the builds, updates and merges of an index by the threads and processes using it, e.g. the
+    crawler workers. The lock file is next to the index directory, which a build replaces.
+    :param blocking: wait for the lock. Otherwise, the lock is only taken if it is free.
+    :return: context manager giving True if the lock is held
+    """
+    if not _index_thread_lock.acquire(blocking):
+        yield False
+        return
+
+    try:
+        with open(index_dir.rstrip("/") + ".lock", "w") as f:
+            locked = True
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    locked = False
+            yield locked
+    finally:
+        _index_thread_lock.release()
+
+
+def _read_segments(index_dir: str):
+    """
+    Reads the segment list of an index.
+    :return: dictionary with the segments ({"name", "num_docs", "deleted"} in document order), the last change id
+             applied and the indexed fields, or None if the index has no segment list (not built or older release)
+    """
+    try:
+        with open(os.path.join(index_dir, "segments.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_segments(index_dir: str, segments: dict):
+    """
+    Replaces the segment list of an index. Readers see either the old or the new list.
+    """
+    with open(os.path.join(index_dir, "segments.json.tmp"), "w") as f:
+        json.dump(segments, f)
+    os.replace(os.path.join(index_dir, "segments.json.tmp"), os.path.join(index_dir, "segments.json"))
+
+
+def _remove_orphans(index_dir: str):
+    """
+    Removes the files left next to the segments of an index by a build, an update or a merge whose process exited
+    before it completed, e.g. a crawler job. Call it with the index lock held.
+    """
+    segments = _read_segments(index_dir)
+    if segments is None:
+        return
+
+    names = {segment["name"] for segment in segments["segments"]}
+    orphans = [os.path.join(index_dir, name) for name in os.listdir(index_dir)
+               if (name.startswith("segment-") and name not in names) or name == "segments.json.tmp"]
+    orphans += [path for path in (index_dir.rstrip("/") + ".tmp", index_dir.rstrip("/") + ".old")
+                if os.path.exists(path)]
+    for path in orphans:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+    if orphans:
+        print(f"{len(orphans)} file(s) of interrupted BM25 index builds, updates or merges removed.")
+
+
+def _segment_name():
+    return f"segment-{datetime.now():%Y%m%d%H%M%S%f}"
+
+
+@lru_cache(maxsize=65536)
+def _sanitized(text: str):
+    """
+    Sanitized tokens of a text. Department and university names repeat across faculty, so they are cached.
+    """
+    return tuple(sanitizer(text))
+
+
+def _field_tokens(column: str, value: str):
+    """
+    Tokens of a faculty_info column, sanitized as the queries are.
+    """
+    if not value:
+        return []
+    if column in SANITIZED_COLUMNS:
+        return value.split()
+    return list(_sanitized(value))
 
 
 class Ranker:
 
-    def __init__(self, corpus: list):
+    def __init__(self, corpus=None, index: BM25Index = None):
         """
         Ranker class to do ranking of docs on Corpus
-        :param corpus:
+        :param corpus: iterable of strings in "<id> <doc>" format, e.g. FacultyDB().iter_biodata_records().
+                       It is read once into an in-memory BM25Index.
+        :param index: prebuilt index (BM25Index or BM25Segments) to rank with instead of a corpus, see build and load
+        """
+        self.index = index if index is not None else BM25Index.build(corpus)
+        self.doc_ids = self.index.doc_ids
+
+        self.logger = logging.getLogger('my_module_name')
+        self.logger.setLevel(logging.WARNING)
+
+    @staticmethod
+    def index_dir():
         """
-        self.corpus = corpus
-        self.logger = logging.getLogger('my_module_name').setLevel(logging.WARNING)
+        Get the directory of the prebuilt index, "ranker.index_dirname" under data/.
+        """
+        dirname = os.path.dirname(__file__)
+        return os.path.join(dirname, "../../../data/", get_config("ranker").get("index_dirname", "bm25"))
 
-    def score(self,  query: str, n: int = 10):
+    @classmethod
+    def build(cls, index_dir: str = None, if_missing: bool = False):
+        """
+        Builds the index of all faculty biodata stored in FacultyDB and saves it for load, as a single segment.
+        Run it once on deployment: python -m apps.backend.utils.ranker build
+        :param index_dir: index directory. Defaults to index_dir().
+        :param if_missing: only build if no index was built yet, e.g. by another process meanwhile
+        :return: Ranker over the new index, or over the existing one with if_missing
+        """
+        index_dir = index_dir or cls.index_dir()
+        with _index_lock(index_dir):
+            if if_missing and _index_version(index_dir) is not None:
+                return cls.load(index_dir)
+            return cls.__build(index_dir)
+
+    @classmethod
+    def __build(cls, index_dir: str):
+        """
+        Builds the index, the index lock being held.
+        Private method. Not accessible outside the class.
+        """
+        from apps.backend.utils.facultydb import FacultyDB
+
+        faculty_db = FacultyDB()
+        data_version = faculty_db.get_data_version()
+        index = cls.__build_index(faculty_db)
+
+        # the index is written next to the index directory first and then moved in place
+        tmp_dir, old_dir = index_dir.rstrip("/") + ".tmp", index_dir.rstrip("/") + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        name = _segment_name()
+        index.save(os.path.join(tmp_dir, name), data_version=data_version)
+        _write_segments(tmp_dir, {"segments": [{"name": name, "num_docs": index.num_docs, "deleted": []}],
+                                  "last_change_id": data_version, "fields": index.fields})
+
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+        # the changes logged from now on are applied by update
+        FacultyDB(snapshot=False).set_sync_state("bm25", data_version)
+
+        print(f"BM25{'F' if index.fields else ''} index of {index.num_docs} document(s) and {len(index.terms)} "
+              f"term(s) built.")
+        return cls(index=BM25Segments([index]))
+
+    @classmethod
+    def from_faculty_db(cls, id: list = None):
+        """
+        Ranker over an in-memory index of faculty stored in FacultyDB, built from the same fields as build but not
+        saved, e.g. to rank when no index was built.
+        :param id: list of faculty ids, e.g. the faculty matching the search filters. Defaults to all faculty.
+        :return: Ranker over the new index
+        """
+        from apps.backend.utils.facultydb import FacultyDB
+
+        return cls(index=cls.__build_index(FacultyDB(), id))
+
+    @staticmethod
+    def __build_index(faculty_db, id: list = None):
+        """
+        Indexes faculty stored in FacultyDB: with BM25F over the faculty_info columns of ranker.fields, their ids
+        being kept out of the tokens, or with BM25 over "<id> <biodata>" documents if no fields are configured.
+        Private method. Not accessible outside the class.
+        :param faculty_db: FacultyDB to read the faculty from
+        :param id: list of faculty ids. Defaults to all faculty.
+        :return: BM25Index
+        """
+        config = get_config("ranker")
+        fields = config.get("fields", [])
+        k1, b, epsilon = config.get("k1", 1.5), config.get("b", 0.75), config.get("epsilon", 0.25)
+
+        columns = ["id"] + ([field["name"] for field in fields] if fields else ["faculty_biodata"])
+        records = faculty_db.iter_faculty_records(columns=columns, id=id) if id is None or id else []
+
+        if not fields:
+            corpus = (str(record["id"]) + " " + record["faculty_biodata"]
+                      for record in records if record["faculty_biodata"] is not None)
+            return BM25Index.build(corpus, k1, b, epsilon)
+
+        field_records = ((record["id"], [_field_tokens(field["name"], record[field["name"]]) for field in fields])
+                         for record in records)
+        return BM25Index.build_fields(field_records, fields, k1, epsilon)
+
+    @classmethod
+    def load(cls, index_dir: str = None):
+        """
+        Loads the index saved by build, update and merge. Its postings and document arrays are memory mapped.
+        :param index_dir: index directory. Defaults to index_dir().
+        :return: Ranker over the index
+        """
+        index_dir = index_dir or cls.index_dir()
+        segments = _read_segments(index_dir)
+        if segments is None:
+            # single index of an older release
+            return cls(index=BM25Segments([BM25Index.load(index_dir)]))
+
+        # unless the index is being changed meanwhile
+        with _index_lock(index_dir, blocking=False) as locked:
+            if locked:
+                _remove_orphans(index_dir)
+
+        indexes = []
+        for segment in segments["segments"]:
+            segment_dir = os.path.abspath(os.path.join(index_dir, segment["name"]))
+            if segment_dir not in _segments:
+                _segments[segment_dir] = BM25Index.load(segment_dir)
+            indexes.append(_segments[segment_dir])
+
+        # forget the segments merged since
+        segment_dirs = {os.path.abspath(os.path.join(index_dir, segment["name"])) for segment in segments["segments"]}
+        for segment_dir in [d for d in _segments if os.path.dirname(d) == os.path.abspath(index_dir)]:
+            if segment_dir not in segment_dirs:
+                del _segments[segment_dir]
+
+        return cls(index=BM25Segments(indexes, [segment["deleted"] for segment in segments["segments"]]))
+
+    @classmethod
+    def update(cls, index_dir: str = None):
+        """
+        Applies the faculty_info changes logged since the index was built or last updated: the inserted and
+        updated faculty are indexed in a new segment, and their previous versions and the deleted
+        faculty are masked out of the older segments. Segments are merged once there are more than
+        ranker.max_segments of them, and all segments are merged again, leaving out the deleted documents, once the
+        documents added or deleted since the last full merge exceed ranker.merge_ratio of the corpus. The merge runs
+        in the update, so that it completes before the caller exits, e.g. a crawler job.
+        Called by FacultyDB.add_records.
+        :param index_dir: index directory. Defaults to index_dir().
+        :return: number of changed faculty applied, or None if there is no index to update
+        """
+        from apps.backend.utils.facultydb import FacultyDB
+
+        index_dir = index_dir or cls.index_dir()
+        if _index_version(index_dir) is None:
+            return None
+
+        faculty_db = FacultyDB(snapshot=False)
+        fields = get_config("ranker").get("fields", [])
+
+        with _index_lock(index_dir):
+            segments = _read_segments(index_dir)
+            changes, last_change_id = (faculty_db.get_changes("bm25", segments["last_change_id"])
+                                       if segments and segments.get("fields", []) == fields else (None, None))
+            if changes is None:
+                # index of an older release or of other fields, or changes pruned from the change log before they
+                # were applied
+                print("BM25 index cannot be updated from the change log, rebuilding it.")
+                cls.__build(index_dir)
+                return None
+
+            if not changes:
+                return 0
+
+            # previous versions of the changed faculty
+            changed_ids = np.array([faculty_id for faculty_id, _ in changes], dtype=np.int64)
+            for segment in segments["segments"]:
+                doc_ids = np.load(os.path.join(index_dir, segment["name"], "doc_ids.npy"), mmap_mode="r")
+                stale_ids = np.asarray(doc_ids)[np.isin(doc_ids, changed_ids)]
+                segment["deleted"] = sorted(set(segment["deleted"]) | set(stale_ids.tolist()))
+
+            upserted_ids = [faculty_id for faculty_id, operation in changes if operation == 'upsert']
+            index = cls.__build_index(faculty_db, upserted_ids)
+            if index.num_docs:
+                name = _segment_name()
+                index.save(os.path.join(index_dir, name), last_change_id=last_change_id)
+                segments["segments"].append({"name": name, "num_docs": index.num_docs, "deleted": []})
+
+            segments["last_change_id"] = last_change_id
+            _write_segments(index_dir, segments)
+            faculty_db.set_sync_state("bm25", last_change_id)
+
+        print(f"BM25 index updated with {index.num_docs} changed and {len(changes) - len(upserted_ids)} deleted "
+              f"record(s).")
+
+        full = cls.__merge_policy(segments)
+        if full is not None:
+            # the changes are applied, a failed merge is retried by the next update
+            try:
+                cls.merge(index_dir, full)
+
+            except Exception as e:
+                print(f"Unexpected exception encountered while merging the BM25 index: {e}")
+
+        return len(changes)
+
+    @staticmethod
+    def __merge_policy(segments: dict):
+        """
+        Decides whether the segments are to be merged.
+        Private method. Not accessible outside the class.
+        :return: True to merge all segments, False to merge the segments after the first, None not to merge
+        """
+        config = get_config("ranker")
+        num_docs = sum(segment["num_docs"] for segment in segments["segments"])
+        num_changed = sum(len(segment["deleted"]) for segment in segments["segments"]) + \
+            sum(segment["num_docs"] for segment in segments["segments"][1:])
+
+        if num_changed > config.get("merge_ratio", 0.1) * num_docs:
+            return True
+        if len(segments["segments"]) > config.get("max_segments", 8):
+            return False
+        return None
+
+    @classmethod
+    def merge(cls, index_dir: str = None, full: bool = True):
+        """
+        Merges segments of the index into one, leaving out the deleted documents. Updates of the index wait for the
+        merge. Run it from cron to merge outside of the updates: python -m apps.backend.utils.ranker merge
+        :param index_dir: index directory. Defaults to index_dir().
+        :param full: merge all segments instead of the segments after the first
+        :return: name of the merged segment or None if there was nothing to merge
+        """
+        index_dir = index_dir or cls.index_dir()
+        with _index_lock(index_dir):
+            _remove_orphans(index_dir)
+            segments = _read_segments(index_dir)
+            if segments is None:
+                return None
+
+            merged_segments = segments["segments"][0 if full else 1:]
+            if not merged_segments or (len(merged_segments) == 1 and not merged_segments[0]["deleted"]):
+                return None
+
+            indexes = [BM25Index.load(os.path.join(index_dir, segment["name"])) for segment in merged_segments]
+            live = [~np.isin(index.doc_ids, np.asarray(segment["deleted"], dtype=np.int64))
+                    for index, segment in zip(indexes, merged_segments)]
+            index = BM25Index.merge(indexes, live)
+            name = _segment_name()
+            index.save(os.path.join(index_dir, name), last_change_id=segments["last_change_id"])
+
+            position = len(segments["segments"]) - len(merged_segments)
+            segments["segments"][position:] = [{"name": name, "num_docs": index.num_docs, "deleted": []}]
+            _write_segments(index_dir, segments)
+
+        # readers still using a merged segment keep reading its memory mapped files
+        for segment in merged_segments:
+            shutil.rmtree(os.path.join(index_dir, segment["name"]), ignore_errors=True)
+
+        print(f"{len(merged_segments)} BM25 index segment(s) merged into {name}.")
+        return name
+
+    def score(self,  query: str, n: int = 10, doc_ids: list = None):
         """
         Ranks list of string (docs) based on the query string using BM25 algorithm.
+        Only the postings of the query terms are read.
         :param query: the query string aginst which the scoring will be done
         :param n: no of documents to return based on the ranking
+        :param doc_ids: ids of the docs to rank, e.g. the faculty matching the search filters.
+                        The BM25 statistics are those of these docs, as for a Ranker built on them only.
         :return: Returns a list of ids that are ranked as per the bm25 logic.
         """
-        if not self.corpus or not query or n < 1:
+        if not self.index.num_docs or not query or n < 1:
             self.logger.error(f"Invalid Corpus or query or search result count")
-            self.logger.error(f"Corpus doc Count: {len(self.corpus)}")
+            self.logger.error(f"Corpus doc Count: {self.index.num_docs}")
             self.logger.error(f"Query String: {query}")
             self.logger.error(f"Number of results requested: {n}")
             return ""
 
         results = []
         try:
-            tokenized_corpus = [doc.split(" ") for doc in self.corpus]
             tokenized_query = sanitizer(query)
-
-            results = BM25Okapi(tokenized_corpus).get_top_n(tokenized_query, self.corpus, n=n)
-            results = [int(result.split()[0]) for result in results] if results else []
+            results = self.index.top_n(tokenized_query, n, doc_ids)
 
         except Exception as e:
             print(f"Unexpected exception encountered: {e}")
@@ -44,57 +481,21 @@ class Ranker:
 
 
 if __name__ == '__main__':
-    from pprint import pprint
-
-    corpus = [
-        "1 Geoffrey Werner Challen Teaching Associate Professor 2227 Siebel Center for Comp Sci 201 N. Goodwin Ave. Urbana Illinois 61801 (217) 300-6150 challen@illinois.edu : Primary Research Area CS Education Research Areas CS Education For more information blue Systems Research Group (Defunct) Internet Class: Learn About the Internet on the Internet OPS Class: Learn Operating Systems Online CS 125 Home Page Education Ph.D. Computer Science, Harvard University, 2010 AB Physics, Harvard University, 2003 Academic Positions Associate Teaching Professor, University of Illinois, 2017 . Primary Research Area CS Education Research Areas CS Education For more information blue Systems Research Group (Defunct) Internet Class: Learn About the Internet on the Internet OPS Class: Learn Operating Systems Online CS 125 Home Page . . For more information blue Systems Research Group (Defunct) Internet Class: Learn About the Internet on the Internet OPS Class: Learn Operating Systems Online CS 125 Home Page.",
-        "2 Cheng Zhai Knowledge and information management tools and techniques should be connected to project processes and process owners. Communities of practice and subject matter experts (SMEs), for example, may generate insights that lead to improved control processes; having an internal sponsor can ensure improvements are implemented. Lessons learned register entries may be analyzed to identify common issues that can be addressed by changes to project procedures.",
-        "3 Tools and techniques that connect people to information can be enhanced by adding an element of interaction, for example, include a “contact me” function so users can get in touch with the originators of the lessons and ask for advice specific to their project and context. Interaction and support also helps people find relevant information. Asking for help is generally quicker and easier than trying to identify search terms. Search terms are often difficult to select because people may not know which keywords or key phrases to use to access the information they need.",
-        "4 A deliverable is any unique and verifiable product, result, or capability to perform a service that is required to be produced to complete a process, phase, or project. Deliverables are typically tangible components completed to meet the project objectives and can include components of the project management plan.",
-        "5 Manage Project Knowledge is the process of using existing knowledge and creating new knowledge to achieve the project's objectives and contribute to organizational learning. The key benefits of this process are that prior organizational knowledge is leveraged to produce or improve the project outcomes, and knowledge created by the project is available to support organizational operations and future projects or phases. This process is performed throughout the project. The inputs, tools and techniques, and outputs of the process are depicted in Figure 4-8. Figure 4-9 depicts the data flow diagram for the process.",
-        "6 High-level strategic and operational assumptions and constraints are normally identified in the business case before the project is initiated and will flow into the project charter. Lower-level activity and task assumptions are generated throughout the project such as defining technical specifications, estimates, the schedule, risks, etc. The assumption log is used to record all assumptions and constraints throughout the project life cycle.",
-        "7 The project charter is the document issued by the project initiator or sponsor that formally authorizes the existence of a project and provides the project manager with the authority to apply organizational resources to project activities. It documents the high-level information on the project and on the product, service, or result the project is intended to satisfy, such as."
-    ]
-
-    from  apps.backend.utils.facultydb import FacultyDB
-
-    corpus = FacultyDB().get_biodata_records()
-
-    ranker = Ranker(corpus)
-    #query = "Knowledge is the process "
-    query = "Marcelo Worsley"
-    results = ranker.score(query, 10)
-    print(f" Result for query 0 '{query}'")
-    pprint(results)
-    print("\n")
-
-    """
-    query = "Cheng Zhai Knowledge"
-    results = ranker.score(query, 4)
-    print(f" Result for query 1 '{query}'")
-    pprint(results)
-
-    print("\n")
-
-    query = "are document"
-    results = ranker.score(query, 4)
-    print(f" Result for query 2 '{query}'")
-    pprint(results)
-
-    print("\n")
-
-    query = "walmart costco"
-    results = ranker.score(query, 4)
-    print(f" Result for query 3 '{query}'")
-    pprint(results)
-
-    print("\n")
-
-    query = "sdfkjghn sjfdkgn fds;jg ;osfdghjish955 "
-    results = ranker.score(query, 4)
-    print(f" Result for query 4 '{query}'")
-    pprint(results)
-    """
-
+    # python -m apps.backend.utils.ranker build | update | merge | search <query>
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
 
+    if command == "build":
+        Ranker.build()
+    elif command == "update":
+        Ranker.update()
+    elif command == "merge":
+        Ranker.merge()
+    elif command == "search" and len(sys.argv) > 2:
+        from pprint import pprint
 
+        query = " ".join(sys.argv[2:])
+        print(f" Result for query '{query}'")
+        pprint(Ranker.load().score(query, 10))
+    else:
+        print("Usage: python -m apps.backend.utils.ranker [build | update | merge | search <query>]")
+        sys.exit(2)
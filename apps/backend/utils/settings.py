@@ -0,0 +1,25 @@
+import os
+import json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def load_config():
+    """
+    Reads config/config.json once per process.
+    :return: dictionary with the whole configuration
+    """
+    dirname = os.path.dirname(__file__)
+    config_file = os.path.join(dirname, '../../../config/config.json')
+
+    with open(config_file, "r") as jsonfile:
+        return json.load(jsonfile)
+
+
+def get_config(section: str):
+    """
+    Get a section of config/config.json, e.g. "database" or "elasticsearch".
+    :param section: top level key of the configuration
+    :return: dictionary with the section or an empty dictionary if the section is not configured
+    """
+    return load_config().get(section, {})
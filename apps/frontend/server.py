@@ -12,25 +12,40 @@ from decouple import config
 
 sys.path.append(os.path.join(os.path.dirname(sys.path[0]), 'apps'))
 
-from apps.backend.utils.facultydb import FacultyDB
 from apps.backend.utils.document import extract_expert_ner
 from apps.frontend.crawler.crawler import ExtractFacultyURL
 from apps.frontend.utils.background_task import run_task
 from apps.backend.api.elasticsearchapi import ElasticSearchAPI
+from apps.backend.api.searchcache import SearchCache
+from apps.backend.api.ftssearchapi import FTSSearchAPI
+from apps.backend.utils.settings import get_config
 
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
 app.rootpath = "web/templates"
 sys.path.append(os.path.join(os.path.dirname(sys.path[0]), 'web/templates'))
 
-faculty = FacultyDB()
-uni_list = faculty.get_all_universities()
-loc_list = faculty.get_all_locations()
-dept_list = faculty.get_all_departments()
+# search backend: the Elasticsearch cluster or the embedded SQLite3 full text index
+if get_config("search").get("backend", "elasticsearch") == "sqlite_fts":
+    search_backend = FTSSearchAPI()
+else:
+    search_backend = ElasticSearchAPI()
+search_cache = SearchCache()
+
+# max number of searches accepted by one /search/batch request
+MAX_BATCH_SEARCHES = 1000
 
 @app.route('/')
 def home():
+    facets = search_backend.get_facets()
+    uni_list = [facet["value"] for facet in facets["university"]]
+    loc_list = [facet["value"] for facet in facets["location"]]
+    dept_list = [facet["value"] for facet in facets["department"]]
     return render_template("index.html", unis = uni_list, locs = loc_list, deps = dept_list)
 
+@app.route('/facets', methods=['GET'])
+def facets():
+    return jsonify(search_backend.get_facets())
+
 @app.route('/admin')
 def admin():
     return render_template('admin.html')
@@ -78,20 +93,75 @@ def search():
     locfilter = data['selected_loc_filters']
     unifilter = data['selected_uni_filters']
     deptfilter = data["selected_dept_filters"]
-    num_results = data['num_results']
-
-    if num_results >100:
-        num_of_results = 100
-    elasticsearchapi = ElasticSearchAPI()
+    num_results = min(int(data['num_results']), 100)
+    offset = max(int(data.get('offset', 0)), 0)
+    # cursor pagination: "paginate" asks for a cursor with the first page, "cursor" asks for the next page
+    cursor = data.get('cursor')
+    paginate = data.get('paginate', False) or bool(cursor)
     # search_result = search_obj.get_search_results(querytext, "Manipal", "Computer", "Sikkim")
     print(f"query => {querytext}")
     print(f"num_results => {num_results}")
     print(f"unifilter => {unifilter}")
     print(f"deptfilter => {deptfilter}")
     print(f"locfilter => {locfilter}")
-    search_result = elasticsearchapi.get_search_results(querytext, num_results, unifilter, deptfilter, locfilter)
 
-    # print(search_result)
+    # cursor pages are not cached: they are bound to a point in time that expires
+    cache_key = None
+    if not paginate:
+        version = search_backend.get_index_version()
+        if version:
+            cache_key = search_cache.key(version, querytext, num_results, unifilter, deptfilter, locfilter, offset)
+            cached_response = search_cache.get(cache_key)
+            if cached_response is not None:
+                return jsonify(cached_response)
+
+    page = search_backend.get_search_page(querytext, num_results, unifilter, deptfilter, locfilter, cursor,
+                                            paginate, offset, with_facets=True)
+    search_result = page["results"]
+
+    results = format_results(search_result)
+    pprint(results)
+
+    response = {
+        "docs": results,
+        "cursor": page["cursor"],
+        "facets": page["facets"]
+    }
+    if cache_key and results:
+        search_cache.set(cache_key, response)
+
+    return jsonify(response)
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    data = json.loads(request.data.decode("utf-8"))
+    if len(data['searches']) > MAX_BATCH_SEARCHES:
+        return jsonify({
+            "msg": f"Too many searches in the batch. At most {MAX_BATCH_SEARCHES} searches are accepted per request."
+        }), 413
+
+    searches = [{"query": search['query'],
+                 "num_results": min(int(search.get('num_results', 10)), 100),
+                 "offset": max(int(search.get('offset', 0)), 0),
+                 "university_filter": search.get('selected_uni_filters'),
+                 "department_filter": search.get('selected_dept_filters'),
+                 "location_filter": search.get('selected_loc_filters')}
+                for search in data['searches']]
+
+    batch_results = search_backend.get_batch_search_results(searches)
+
+    return jsonify({
+        "results": [{"docs": format_results(search_result)} for search_result in batch_results]
+    })
+
+
+def format_results(search_result):
+    """
+    Converts faculty dictionaries to the result rows of the search page, with the expertise cleaned by NER.
+    :param search_result: list of faculty dictionaries
+    :return: list of tuples
+    """
     faculty_names = []
     faculty_homepage_url = []
     faculty_department_url = []
@@ -116,14 +186,14 @@ def search():
         change_expertise = " ".join(set(extract_expert_ner(v['faculty_expertise']).split()))
         faculty_expertise.append(change_expertise)
 
-    results = list(zip(faculty_names, faculty_homepage_url, faculty_department_url, faculty_department_name,
-                       faculty_university_url, faculty_university_name, faculty_email, faculty_phone, faculty_location,
-                       faculty_expertise))
-    pprint(results)
+    return list(zip(faculty_names, faculty_homepage_url, faculty_department_url, faculty_department_name,
+                    faculty_university_url, faculty_university_name, faculty_email, faculty_phone, faculty_location,
+                    faculty_expertise))
 
-    return jsonify({
-        "docs": results
-    })
+
+@app.route('/search/cache/stats', methods=['GET'])
+def search_cache_stats():
+    return jsonify(search_cache.stats())
 
 
 def is_redis_available(r):
@@ -69,9 +69,9 @@ var doSearch = function() {
     const data = {
         "query": searchTerm,
         "num_results": numResults,
-        "selected_loc_filters" : selected_loc_filters.length > 0 ? selected_loc_filters[0] : "",
-        "selected_uni_filters":  selected_uni_filters.length > 0 ? selected_uni_filters[0] : "",
-        "selected_dept_filters": selected_dept_filters.length > 0 ? selected_dept_filters[0] : ""
+        "selected_loc_filters" : selected_loc_filters,
+        "selected_uni_filters":  selected_uni_filters,
+        "selected_dept_filters": selected_dept_filters
     }
     if (searchTerm!=='')
     {
@@ -0,0 +1,462 @@
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from elasticsearch import ConnectionError as ESConnectionError
+from rank_bm25 import BM25Okapi
+
+from apps.backend.api import elasticsearchapi
+from apps.backend.api.elasticsearchapi import ElasticSearchAPI
+from apps.backend.api.searchcache import SearchCache
+from apps.backend.utils.bm25index import BM25Index, BM25Segments
+from apps.backend.utils.compression import decompress_text
+from apps.backend.utils.facultydb import FacultyDB
+from apps.backend.utils.ranker import Ranker
+from apps.backend.utils.settings import get_config
+
+
+def faculty(name, university, department="Computer Science", location="Illinois"):
+    return {"faculty_name": name,
+            "faculty_homepage_url": f"http://{name.lower()}.example.edu/",
+            "faculty_department_url": "http://cs.example.edu/",
+            "faculty_department_name": department,
+            "faculty_university_url": "http://example.edu/",
+            "faculty_university_name": university,
+            "faculty_email": None,
+            "faculty_phone": None,
+            "faculty_location": location,
+            "faculty_expertise": "databases",
+            "faculty_biodata": f"{name} works on {university} databases"}
+
+
+class FacultyDBTestCase(unittest.TestCase):
+    """
+    FacultyDB on a database file of its own, without snapshots and BM25 index updates.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.faculty_db = FacultyDB(snapshot=False)
+        self.faculty_db.db_file = os.path.join(self.tmp_dir, "faculty.db")
+        self.faculty_db.snapshot_after_add = False
+        self.faculty_db.ranker_update_after_add = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class FacultyDBFilterTest(FacultyDBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(FacultyDB, "sync_search_index"):
+            self.faculty_db.add_records([faculty("Ada", "Uni of ABC"),
+                                         faculty("Bob", "Uni of XYZ"),
+                                         faculty("Cy", "Uni of XYZ Labs"),
+                                         faculty("Dee", "Uni of XY[")])
+        self.ids = dict(zip(["Ada", "Bob", "Cy", "Dee"], sorted(self.faculty_db.get_faculty_ids())))
+
+    def get_names(self, match, **filters):
+        ids = set(self.faculty_db.get_faculty_ids(match=match, **filters))
+        return sorted(name for name, id in self.ids.items() if id in ids)
+
+    def test_exact_match_ignores_case(self):
+        self.assertEqual(self.get_names("exact", university_filter="uni of xyz"), ["Bob"])
+
+    def test_prefix_match_of_value_ending_in_upper_case(self):
+        self.assertEqual(self.get_names("prefix", university_filter="Uni of XYZ"), ["Bob", "Cy"])
+        self.assertEqual(self.get_names("prefix", university_filter="UNI OF XY"), ["Bob", "Cy", "Dee"])
+
+    def test_prefix_match_ignores_case(self):
+        self.assertEqual(self.get_names("prefix", university_filter="uni of xyz"), ["Bob", "Cy"])
+        self.assertEqual(self.get_names("prefix", university_filter=["uni of a", "Uni of XYZ L"]), ["Ada", "Cy"])
+
+    def test_prefix_match_of_value_ending_before_letters(self):
+        with mock.patch.object(FacultyDB, "sync_search_index"):
+            self.faculty_db.add_records([faculty("Eve", "Uni@Home"), faculty("Fay", "Uni[Home")])
+        self.assertEqual(self.faculty_db.get_faculty_ids(university_filter="Uni@", match="prefix"),
+                         self.faculty_db.get_faculty_ids(university_filter="uni@home", match="exact"))
+
+
+class FacultyDBSyncTest(FacultyDBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("apps.backend.utils.facultydb.ElasticSearchAPI")
+        self.elasticsearchapi = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.elasticsearchapi.get_current_index.return_value = "faculty_index_v1"
+        self.elasticsearchapi.add_records.return_value = {"indexed": 2, "failed": 0, "failed_chunks": []}
+        self.elasticsearchapi.sync_records.return_value = {"indexed": 1, "failed": 0, "failed_chunks": []}
+
+    def test_unchanged_records_are_not_synced(self):
+        records = [faculty("Ada", "Uni of ABC"), faculty("Bob", "Uni of XYZ")]
+        with mock.patch.object(FacultyDB, "sync_search_index") as sync_search_index:
+            self.faculty_db.add_records(records)
+            self.faculty_db.add_records(records)
+        self.assertEqual(sync_search_index.call_count, 1)
+
+    def test_sync_without_changes_keeps_the_index_version(self):
+        self.faculty_db.add_records([faculty("Ada", "Uni of ABC"), faculty("Bob", "Uni of XYZ")])
+        self.assertEqual(self.elasticsearchapi.sync_records.call_count, 1)
+
+        self.faculty_db.sync_search_index()
+        self.assertEqual(self.elasticsearchapi.sync_records.call_count, 1)
+        self.assertEqual(self.elasticsearchapi.add_records.call_count, 0)
+
+        self.faculty_db.add_records([faculty("Ada", "Uni of DEF")])
+        self.assertEqual(self.elasticsearchapi.sync_records.call_count, 2)
+        upserted = list(self.elasticsearchapi.sync_records.call_args[0][0])
+        self.assertEqual([record["faculty_university_name"] for record in upserted], ["Uni of DEF"])
+
+
+class FacultyDBFullTextIndexTest(FacultyDBTestCase):
+
+    def add_and_delete(self):
+        with mock.patch.object(FacultyDB, "sync_search_index"):
+            self.faculty_db.add_records([faculty("Ada", "Uni of ABC"), faculty("Bob", "Uni of XYZ")])
+        conn = sqlite3.connect(self.faculty_db.db_file)
+        conn.create_function("faculty_decompress", 2, lambda codec, data: decompress_text(data, codec))
+        conn.execute("DELETE FROM faculty_info WHERE faculty_name = 'Bob'")
+        conn.commit()
+        return conn
+
+    def test_no_full_text_index_for_elasticsearch_backend(self):
+        self.faculty_db.fts_enabled = False
+        conn = self.add_and_delete()
+
+        self.assertIsNone(conn.execute("SELECT 1 FROM sqlite_master WHERE name LIKE 'faculty_fts%'").fetchone())
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM faculty_biodata").fetchone()[0], 1)
+
+    def test_full_text_index_for_sqlite_fts_backend(self):
+        self.faculty_db.fts_enabled = True
+        conn = self.add_and_delete()
+
+        self.assertEqual([record["faculty_name"] for record in self.faculty_db.search_fts("databases")], ["Ada"])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM faculty_biodata").fetchone()[0], 1)
+
+
+class FacultyDBMigrationTest(FacultyDBTestCase):
+    """
+    Opening a database of the first release, without the change log, the biodata table and the facet counts.
+    """
+
+    def setUp(self):
+        super().setUp()
+        conn = sqlite3.connect(self.faculty_db.db_file)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS faculty_info (
+            id integer PRIMARY KEY,
+            faculty_name text NOT NULL,
+            faculty_homepage_url text NOT NULL UNIQUE,
+            faculty_department_url text NOT NULL,
+            faculty_department_name text NOT NULL,
+            faculty_university_url text NOT NULL,
+            faculty_university_name text NOT NULL,
+            faculty_email text,
+            faculty_phone text,
+            faculty_location NOT NULL,
+            faculty_expertise text NOT NULL,
+            faculty_biodata NOT NULL,
+            last_modified_date text NOT NULL,
+            created_date text NOT NULL
+        );""")
+        self.created = datetime(2021, 12, 6, 10, 0, 0)
+        records = [faculty("Ada", "Uni of ABC"), faculty("Bob", "Uni of XYZ"),
+                   faculty("Cy", "Uni of XYZ", department="Statistics")]
+        conn.executemany("INSERT OR IGNORE INTO faculty_info VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                         [(None,) + tuple(record.values()) + (self.created.isoformat(), self.created.isoformat())
+                          for record in records])
+        conn.commit()
+        conn.close()
+
+        self.ids = dict(zip(["Ada", "Bob", "Cy"], sorted(self.faculty_db.get_faculty_ids())))
+        self.conn = sqlite3.connect(self.faculty_db.db_file)
+        self.addCleanup(self.conn.close)
+
+    def test_schema_version(self):
+        self.assertEqual(self.conn.execute("PRAGMA user_version").fetchone()[0], 2)
+        columns = [column[1] for column in self.conn.execute("PRAGMA table_info(faculty_info)")]
+        self.assertNotIn("faculty_biodata", columns)
+        self.assertNotIn("created_date", columns)
+
+        created_at = int(self.created.timestamp() * 1000)
+        self.assertEqual(self.conn.execute("SELECT DISTINCT created_at, last_modified_at FROM faculty_info").fetchall(),
+                         [(created_at, created_at)])
+
+    def test_biodata_moved_to_compressed_table(self):
+        self.assertEqual(sorted(self.faculty_db.iter_biodata_records()),
+                         [f"{self.ids['Ada']} Ada works on Uni of ABC databases",
+                          f"{self.ids['Bob']} Bob works on Uni of XYZ databases",
+                          f"{self.ids['Cy']} Cy works on Uni of XYZ databases"])
+        codecs = self.conn.execute("SELECT DISTINCT codec FROM faculty_biodata").fetchall()
+        self.assertEqual(codecs, [(self.faculty_db.biodata_codec,)])
+
+    def test_facet_counts(self):
+        facets = self.faculty_db.get_facet_values()
+
+        self.assertEqual(facets["university"], [{"value": "Uni of XYZ", "count": 2},
+                                                {"value": "Uni of ABC", "count": 1}])
+        self.assertEqual(facets["department"], [{"value": "Computer Science", "count": 2},
+                                                {"value": "Statistics", "count": 1}])
+        self.assertEqual(facets["location"], [{"value": "Illinois", "count": 3}])
+
+    def test_change_log(self):
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM faculty_change_log").fetchone()[0], 0)
+
+        with mock.patch.object(FacultyDB, "sync_search_index"):
+            self.faculty_db.add_records([faculty("Bob", "Uni of DEF")])
+        self.conn.execute("DELETE FROM faculty_info WHERE id = ?", (self.ids["Cy"],))
+        self.conn.commit()
+
+        changes = self.conn.execute("SELECT faculty_id, operation, typeof(changed_at) FROM faculty_change_log "
+                                    "ORDER BY change_id").fetchall()
+        self.assertEqual(changes, [(self.ids["Bob"], "upsert", "integer"), (self.ids["Cy"], "delete", "integer")])
+        self.assertEqual(sorted(self.faculty_db.get_changes("elasticsearch")[0]),
+                         sorted([(self.ids["Bob"], "upsert"), (self.ids["Cy"], "delete")]))
+        self.assertEqual(self.faculty_db.get_data_version(), 2)
+
+
+def bm25okapi_ranking(corpus, query, n):
+    """
+    Ids of the n best documents of a "<id> <doc>" corpus for BM25Okapi, ties by descending position.
+    """
+    tokenized_corpus = [doc.split(" ") for doc in corpus]
+    scores = BM25Okapi(tokenized_corpus).get_scores(query)
+    return [int(tokenized_corpus[i][0]) for i in np.argsort(scores, kind="stable")[::-1][:n]]
+
+
+class BM25IndexFilterTest(unittest.TestCase):
+    """
+    Rankings over subsets of the documents, e.g. the faculty matching the search filters, equal BM25Okapi over a
+    corpus of these documents only. The few words are common enough to have negative idf in most subsets.
+    """
+
+    def setUp(self):
+        rnd = random.Random(7)
+        words = ["w" + str(i) for i in range(12)]
+        weights = [1 / (i + 1) for i in range(len(words))]
+        self.corpus = [str(id) + " " + " ".join(rnd.choices(words, weights, k=rnd.randint(1, 20)))
+                       for id in range(1, 61)]
+        self.queries = [rnd.choices(words + ["unknown"], k=rnd.randint(1, 4)) for _ in range(20)]
+        self.subsets = [sorted(rnd.sample(range(60), rnd.randint(1, 60))) for _ in range(10)]
+
+    def assert_rankings(self, index, corpus):
+        for subset in self.subsets:
+            doc_ids = [int(corpus[i].split(" ")[0]) for i in subset]
+            for query in self.queries:
+                for n in (1, 5, 60):
+                    self.assertEqual(index.top_n(query, n, doc_ids),
+                                     bm25okapi_ranking([corpus[i] for i in subset], query, n))
+
+    def test_index_subsets(self):
+        self.assert_rankings(BM25Index.build(self.corpus), self.corpus)
+
+    def test_segments_subsets(self):
+        # documents 1 to 20 updated in a second segment, documents 21 to 25 deleted
+        updated = [str(id) + " w0 w" + str(id % 5) for id in range(1, 21)]
+        segments = BM25Segments([BM25Index.build(self.corpus), BM25Index.build(updated)],
+                                [list(range(1, 26)), []])
+        corpus = self.corpus[25:] + updated + self.corpus[20:25]
+
+        # the deleted documents are never ranked
+        self.subsets = [[i for i in subset if i < 55] for subset in self.subsets]
+        self.assert_rankings(segments, corpus)
+
+
+class RankerUpdateTest(FacultyDBTestCase):
+    """
+    Index built from FacultyDB, updated with the faculty changed since and merged, compared with an index rebuilt
+    from FacultyDB. Queries are ranked on their tokens, without the query sanitizer.
+    """
+
+    words = ["graph", "vision", "robot", "security", "theory", "data", "language", "system", "learning", "network"]
+    queries = [["graph"], ["data", "system"], ["vision", "robot", "robot"], ["theory", "unknown"]]
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("apps.backend.utils.facultydb.FacultyDB", side_effect=lambda *args, **kwargs:
+                             self.faculty_db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(get_config("ranker"), {"merge_ratio": 1.0, "max_segments": 100})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.rnd = random.Random(5)
+        self.index_dir = os.path.join(self.tmp_dir, "bm25")
+        self.add_records([self.record(i) for i in range(40)])
+        Ranker.build(self.index_dir)
+
+    def record(self, i):
+        return dict(faculty("Name" + str(i), "Uni of " + self.rnd.choice(["ABC", "XYZ"])),
+                    faculty_biodata=" ".join(self.rnd.choices(self.words, k=self.rnd.randint(5, 30))))
+
+    def add_records(self, records):
+        with mock.patch.object(FacultyDB, "sync_search_index"):
+            self.faculty_db.add_records(records)
+
+    def change_records(self):
+        # 5 updated, 3 added and 2 deleted faculty
+        self.add_records([self.record(i) for i in range(5)] + [self.record(i) for i in range(40, 43)])
+        conn = sqlite3.connect(self.faculty_db.db_file)
+        conn.execute("DELETE FROM faculty_info WHERE faculty_name IN ('Name10', 'Name11')")
+        conn.commit()
+        conn.close()
+
+    def segments(self):
+        with open(os.path.join(self.index_dir, "segments.json")) as f:
+            return json.load(f)["segments"]
+
+    def assert_rankings_equal_rebuild(self, index):
+        rebuilt = Ranker.from_faculty_db().index
+        for query in self.queries:
+            scores = dict(zip(rebuilt.doc_ids.tolist(), rebuilt.get_scores(query).tolist()))
+            ranked = index.top_n(query, len(scores))
+
+            self.assertEqual(sorted(ranked), sorted(scores))
+            ranked_scores = [scores[id] for id in ranked]
+            for score, next_score in zip(ranked_scores, ranked_scores[1:]):
+                self.assertGreaterEqual(score + 1e-9, next_score)
+
+    def test_updated_index_ranks_as_rebuilt_index(self):
+        self.change_records()
+        self.assertEqual(Ranker.update(self.index_dir), 10)
+        self.assertEqual(len(self.segments()), 2)
+
+        self.assert_rankings_equal_rebuild(Ranker.load(self.index_dir).index)
+
+    def test_merged_index_scores_as_rebuilt_index(self):
+        self.change_records()
+        Ranker.update(self.index_dir)
+        Ranker.merge(self.index_dir)
+
+        segments = self.segments()
+        self.assertEqual([(segment["num_docs"], segment["deleted"]) for segment in segments], [(41, [])])
+        self.assertEqual(sorted(os.listdir(self.index_dir)), [segments[0]["name"], "segments.json"])
+
+        merged = Ranker.load(self.index_dir).index.segments[0]
+        rebuilt = Ranker.from_faculty_db().index
+        for query in self.queries:
+            scores = dict(zip(rebuilt.doc_ids.tolist(), rebuilt.get_scores(query).tolist()))
+            merged_scores = dict(zip(merged.doc_ids.tolist(), merged.get_scores(query).tolist()))
+            self.assertEqual(sorted(merged_scores), sorted(scores))
+            for id, score in scores.items():
+                self.assertAlmostEqual(merged_scores[id], score, places=9)
+
+    def test_update_merges_before_returning(self):
+        self.change_records()
+        with mock.patch.dict(get_config("ranker"), {"merge_ratio": 0.1}):
+            Ranker.update(self.index_dir)
+
+        self.assertEqual(len(self.segments()), 1)
+        self.assert_rankings_equal_rebuild(Ranker.load(self.index_dir).index)
+
+    def test_load_removes_files_of_interrupted_updates(self):
+        name = self.segments()[0]["name"]
+        os.makedirs(os.path.join(self.index_dir, "segment-20211206100000000000.tmp"))
+        os.makedirs(os.path.join(self.index_dir, "segment-20211206100000000000"))
+        os.makedirs(self.index_dir + ".tmp")
+        open(os.path.join(self.index_dir, "segments.json.tmp"), "w").close()
+
+        Ranker.load(self.index_dir)
+
+        self.assertEqual(sorted(os.listdir(self.index_dir)), [name, "segments.json"])
+        self.assertFalse(os.path.exists(self.index_dir + ".tmp"))
+
+
+class SearchCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SearchCache()
+        self.cache.redis = None
+
+    def test_key_normalizes_query_and_filters(self):
+        self.assertEqual(self.cache.key("v1", "  Machine   LEARNING ", 10, ["UIUC", " MIT"], "CS", None),
+                         self.cache.key("v1", "machine learning", 10, ["MIT", "UIUC", ""], ["CS"], []))
+        self.assertNotEqual(self.cache.key("v1", "machine learning", 10),
+                            self.cache.key("v1", "machine learning", 20))
+        self.assertNotEqual(self.cache.key("v1", "machine learning", 10),
+                            self.cache.key("v1", "machine learning", 10, offset=10))
+        self.assertNotEqual(self.cache.key("v1", "machine learning", 10),
+                            self.cache.key("v2", "machine learning", 10))
+
+    def test_entries_expire_after_ttl(self):
+        key = self.cache.key("v1", "vision", 10)
+        with mock.patch("apps.backend.api.searchcache.time.time", return_value=1000.0):
+            self.cache.set(key, {"docs": [1]})
+            self.assertEqual(self.cache.get(key), {"docs": [1]})
+        with mock.patch("apps.backend.api.searchcache.time.time", return_value=1000.0 + self.cache.ttl + 1):
+            self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.max_entries = 2
+        keys = [self.cache.key("v1", query, 10) for query in ("a", "b", "c")]
+        self.cache.set(keys[0], "a")
+        self.cache.set(keys[1], "b")
+        self.cache.get(keys[0])
+        self.cache.set(keys[2], "c")
+
+        self.assertEqual(self.cache.get(keys[0]), "a")
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertEqual(self.cache.get(keys[2]), "c")
+
+    def test_new_index_version_invalidates_entries(self):
+        old_key = self.cache.key("faculty_index_v1@2021-12-06T10:00:00", "vision", 10)
+        self.cache.set(old_key, "old")
+        new_key = self.cache.key("faculty_index_v1@2021-12-06T11:00:00", "vision", 10)
+
+        self.assertIsNone(self.cache.get(new_key))
+        self.assertIsNone(self.cache.get(old_key))
+        stats = self.cache.stats()
+        self.assertGreaterEqual(stats["invalidations"], 1)
+        self.assertEqual(stats["local_hits"], 0)
+
+
+class ElasticSearchAPIUnavailableTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(elasticsearchapi, "get_client")
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(elasticsearchapi._index_version, {"version": None, "checked_at": 0.0,
+                                                                    "failed_at": None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.es.indices.get_mapping.side_effect = ESConnectionError("N/A", "Connection refused", None)
+        self.api = ElasticSearchAPI()
+
+    def test_searches_fail_fast_after_a_connection_error(self):
+        self.assertIsNone(self.api.get_index_version())
+        page = self.api.get_search_page("vision", 10, paginate=False, with_facets=True)
+
+        self.assertEqual(page["results"], [])
+        self.assertEqual(self.api.get_batch_search_results([{"query": "vision"}]), [[]])
+        self.assertIsNone(self.api.get_index_version())
+        self.assertEqual(self.es.indices.get_mapping.call_count, 1)
+        self.es.search.assert_not_called()
+        self.es.msearch.assert_not_called()
+
+    def test_cluster_is_called_again_after_the_retry_interval(self):
+        self.assertIsNone(self.api.get_index_version())
+        self.api.unavailable_retry_interval = 0
+        self.es.indices.get_mapping.side_effect = None
+        self.es.indices.get_mapping.return_value = {"faculty_index_v1": {"mappings": {}}}
+
+        self.assertEqual(self.api.get_index_version(), "faculty_index_v1@")
+
+
+if __name__ == '__main__':
+    unittest.main()